@@ -1,293 +1,478 @@
 import json
-import socket
-import subprocess
-import glob
 import os
-import random
-from datetime import datetime
+import hashlib
 import time
+from datetime import datetime, timedelta
 from apscheduler.schedulers.background import BackgroundScheduler
+from apscheduler.jobstores.sqlalchemy import SQLAlchemyJobStore
 import logging
-from flask import Flask, request, render_template, redirect, url_for
+from flask import Flask, request, render_template, redirect, url_for, jsonify, make_response, Response
 from flask_sqlalchemy import SQLAlchemy
-from device_controller import load_device_config, initialize_devices
-import tinytuya
-
-# Set up logging
-logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+from device_controller import DeviceManager
+from vlc_controller import ThreadedVLCController, VLCSupervisor, PlaybackTracker
+from media_index import MediaIndex
+from media_watcher import MediaWatcher
+from playback_queue import PlaybackQueue
+from rotation import RotationState
+from schedule_cache import ScheduleCache
+import schedule_io
+import metrics
+from log_config import setup_logging
+from schedule_conflicts import ScheduleConflictIndex, find_batch_conflicts
+from scheduler_engine import (minute_trigger, offset_trigger, shift_mask, misfire_grace_for, next_occurrence,
+                              nearest_occurrence, JobReconciler, TriggerRecorder, MISFIRE_GRACE_SECONDS,
+                              STOP_LEAD_SECONDS)
+from schedule_schema import (parse_time_to_minutes, minutes_to_time_str, days_to_mask, mask_to_days,
+                             weekday_bit, masks_with_day, migrate_schedule_table, DAY_START_INDEX, MISFIRE_POLICIES)
+
+# Set up logging: JSON lines written by a background listener, levels from LOG_LEVEL/LOG_LEVELS
+setup_logging()
+logger = logging.getLogger('app')
 
 # Database setup
 app = Flask(__name__)
 app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///schedules.db'
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+# Reject schedules that overlap an existing one instead of only logging a warning
+app.config['REJECT_SCHEDULE_CONFLICTS'] = os.environ.get('REJECT_SCHEDULE_CONFLICTS', '0') == '1'
+# Seconds before each start to launch VLC and queue the playlist, so the start only sends 'play' (0 disables)
+app.config['PREROLL_SECONDS'] = int(os.environ.get('PREROLL_SECONDS', 30))
+# Volume in percent (0-100, 100 = VLC's normal level) set during pre-roll, unset keeps VLC's current volume
+app.config['PLAYBACK_VOLUME'] = int(os.environ['PLAYBACK_VOLUME']) if os.environ.get('PLAYBACK_VOLUME') else None
+# Seconds the volume ramps down before the final stop at a slot's end time (0 stops without fading)
+app.config['FADE_OUT_SECONDS'] = int(os.environ.get('FADE_OUT_SECONDS', 10))
+# Seconds a schedule's devices are switched on before its start, and kept on after its end
+app.config['POWER_ON_LEAD_SECONDS'] = int(os.environ.get('POWER_ON_LEAD_SECONDS', 30))
+app.config['POWER_OFF_DELAY_SECONDS'] = int(os.environ.get('POWER_OFF_DELAY_SECONDS', 30))
+# Seconds between background refreshes of the device state cache
+app.config['DEVICE_POLL_SECONDS'] = float(os.environ.get('DEVICE_POLL_SECONDS', 30))
 db = SQLAlchemy(app)
+metrics.instrument_app(app)
 
-# Initialize devices from configuration
-device_config = load_device_config()
-devices = []
-
-for device in device_config['devices']:
-    d = tinytuya.OutletDevice(
-        dev_id=device['dev_id'],
-        address=device['address'],
-        local_key=device['local_key'],
-        version=device['version']  # Use the version from the config
-    )
-    devices.append(d)
+# Devices from the DEVICE_CONFIG file, loaded on first use and reloaded when it changes;
+# commands run in the manager's thread pool
+device_manager = DeviceManager()
 
 
 # Routes for controlling the TinyTuya devices
 @app.route('/turn_on/<int:device_index>')
 def turn_on(device_index):
-    """Turn on the specified device."""
-    devices[device_index].turn_on()
+    """Turn on the specified device without waiting for it to answer."""
+    device_manager.submit(device_index, 'turn_on')
     return redirect(url_for('index'))
 
 @app.route('/turn_off/<int:device_index>')
 def turn_off(device_index):
-    """Turn off the specified device."""
-    devices[device_index].turn_off()
+    """Turn off the specified device without waiting for it to answer."""
+    device_manager.submit(device_index, 'turn_off')
     return redirect(url_for('index'))
 
+@app.route('/devices/status')
+def devices_status():
+    """Report every device's last known state from the cache, never the network."""
+    return jsonify(device_manager.states())
+
+@app.route('/group/<group>/<any(turn_on, turn_off):action>')
+def group_command(group, action):
+    """Switch every device in a configured group at once and report each device's result."""
+    try:
+        return jsonify(device_manager.group_command(group, action))
+    except KeyError:
+        return jsonify({'error': f"Unknown group: {group}"}), 404
+
 
 # Define the Schedule model
 class Schedule(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     play_music_folder = db.Column(db.String(200), nullable=False)
-    start_time = db.Column(db.String(5), nullable=False)  # HH:MM format
-    end_time = db.Column(db.String(20), nullable=True)  # HH:MM:SS format
-    days = db.Column(db.String(50), nullable=False)  # Comma-separated days
-
-# Create the database and the schedule table if it doesn't exist
-if not os.path.exists('schedules.db'):
-    db.create_all()
-    logging.info("Database created and table initialized.")
-
-class VLCController:
-    def __init__(self, host='127.0.0.1', port=44500):
-        self.host = host
-        self.port = port
-        self.sock = None
-        self.vlc_process = None
-        self.is_playing = False  # Track playback status
-
-    def is_vlc_running(self):
-        """Check if VLC is already running."""
-        return self.vlc_process is not None and self.vlc_process.poll() is None
-
-    def start_vlc(self, media_path=None):
-        """Start VLC with the given media path if provided."""
-        if self.is_vlc_running():
-            logging.warning("VLC is already running.")
-            return
-
-        vlc_command = [
-            r"C:\Program Files\VideoLAN\VLC\vlc.exe",
-            "--intf", "rc",
-            "--rc-host", f"{self.host}:{self.port}",
-            "--verbose", "2"  # Increase verbosity for debugging
-        ]
-        if media_path:
-            vlc_command.append(media_path)
-        
-        logging.info(f"Starting VLC with command: {vlc_command}")
-        self.vlc_process = subprocess.Popen(vlc_command)
-        logging.info("VLC started with RC interface.")
-        time.sleep(2)  # Increased delay to ensure VLC is ready to receive commands
-
-        self.connect()
-
-    def connect(self):
-        """Establish a connection to the VLC RC interface."""
-        try:
-            self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            self.sock.connect((self.host, self.port))
-            logging.info(f"Connected to VLC on {self.host}:{self.port}")
-        except Exception as e:
-            logging.error(f"Error connecting to VLC: {e}")
-
-    def send_command(self, command):
-        """Send a command to VLC."""
-        if self.sock:
-            try:
-                self.sock.sendall(bytes(command + '\n', "utf-8"))
-                logging.info(f"Sent command: {command}")
-                response = self.sock.recv(1024)  # Adjust buffer size if necessary
-                logging.info(f"VLC response: {response.decode('utf-8')}")
-            except socket.error as e:
-                logging.error(f"Socket error when sending command: {e}")
-            except Exception as e:
-                logging.error(f"Error sending command: {e}")
-
-    def close(self):
-        """Close the connection to VLC and terminate the VLC process."""
-        if self.sock:
-            self.sock.close()
-            logging.info("Connection to VLC closed.")
-        if self.vlc_process:
-            self.vlc_process.terminate()
-            self.vlc_process = None
-            logging.info("VLC process terminated.")
-
-    def play(self):
-        """Play the currently loaded media."""
-        if not self.is_playing:
-            self.send_command("play")
-            self.is_playing = True  # Set playing status
-
-    def stop(self):
-        """Stop the music playback only if it's currently playing."""
-        if self.is_playing:
-            self.send_command("stop")
-            logging.info("Music playback stopped.")
-            self.is_playing = False
-        else:
-            logging.info("No music is currently playing to stop.")
-
-    def add_to_playlist(self, media_path):
-        """Add media to the VLC playlist."""
-        self.send_command(f"add {media_path}")
-
-    def set_volume(self, volume):
-        """Set the volume to a specific level."""
-        if 0 <= volume <= 100:
-            self.send_command(f"volume {volume}")
-        else:
-            logging.error("Volume must be between 0 and 100.")
+    start_time = db.Column(db.String(5), nullable=False)  # HH:MM format, kept for display
+    end_time = db.Column(db.String(5), nullable=True)  # HH:MM format, kept for display
+    days = db.Column(db.String(50), nullable=False)  # Comma-separated days, kept for display
+    start_minute = db.Column(db.Integer)  # Minutes after midnight
+    end_minute = db.Column(db.Integer)  # Minutes after midnight, None if no end time
+    day_mask = db.Column(db.Integer)  # Bit 0 = Monday ... bit 6 = Sunday
+    misfire_policy = db.Column(db.String(10))  # skip, grace or slot; None = grace
+    power_devices = db.Column(db.String(200))  # Device group or comma-separated devices; None = none
+
+    __table_args__ = (db.Index(DAY_START_INDEX, 'day_mask', 'start_minute'),)
+
+    def set_times(self, start_time, end_time, days):
+        """Set the normalized columns and their display strings from form values.
+
+        Raises ValueError for an invalid time or when no day is selected.
+        """
+        day_mask = days_to_mask(days)
+        if not day_mask:
+            raise ValueError("No days selected")
+        self.start_minute = parse_time_to_minutes(start_time)
+        self.end_minute = parse_time_to_minutes(end_time)
+        self.day_mask = day_mask
+        self.start_time = minutes_to_time_str(self.start_minute)
+        self.end_time = minutes_to_time_str(self.end_minute)
+        self.days = ','.join(mask_to_days(self.day_mask))
+
+# Create the database and the schedule table if it doesn't exist, then bring it up to the normalized schema
+with app.app_context():
+    # Flask-SQLAlchemy resolves the relative SQLite path into the instance folder; the
+    # job store, media index and rotation tables must use that same file
+    DATABASE_URI = db.engine.url.render_as_string(hide_password=False)
+    if not os.path.exists(db.engine.url.database):
+        db.create_all()
+        logger.info("Database created and table initialized.")
+    migrate_schedule_table(db.engine)
+
+# Cached index of the media files in each schedule folder
+media_index = MediaIndex(DATABASE_URI)
+
+# Per-folder no-repeat shuffle, persisted next to the schedules
+rotation = RotationState(media_index, DATABASE_URI)
+
+def schedule_folders():
+    """Return the music folder of every schedule."""
+    with app.app_context():
+        return [normalize_path(row.play_music_folder)
+                for row in db.session.query(Schedule.play_music_folder).distinct()]
+
+# Keeps the media index warm for every schedule folder
+media_watcher = MediaWatcher(media_index, schedule_folders, build_playlists=False)
 
 def normalize_path(path):
     """Normalize the path to use the correct separators."""
     return os.path.normpath(path)
 
-def convert_days_to_ap_scheduler_format(days):
-    """Convert day names to APScheduler format."""
-    day_map = {
-        "Monday": "mon",
-        "Tuesday": "tue",
-        "Wednesday": "wed",
-        "Thursday": "thu",
-        "Friday": "fri",
-        "Saturday": "sat",
-        "Sunday": "sun"
+def schedule_to_dict(schedule):
+    """Convert a Schedule row to the job dict used by the scheduler and templates."""
+    return {
+        'id': schedule.id,
+        'play_music_folder': schedule.play_music_folder,
+        'start_time': minutes_to_time_str(schedule.start_minute),
+        'end_time': minutes_to_time_str(schedule.end_minute),
+        'days': mask_to_days(schedule.day_mask),
+        'start_minute': schedule.start_minute,
+        'end_minute': schedule.end_minute,
+        'day_mask': schedule.day_mask,
+        'misfire_policy': schedule.misfire_policy,
+        'power_devices': schedule.power_devices
     }
-    converted_days = [day_map[day.strip()] for day in days if day.strip() in day_map]
-    logging.info(f"Converted days: {converted_days}")  # Log converted days
-    return ','.join(converted_days) if converted_days else None
 
 def load_schedules_from_db():
     """Load schedules from the database."""
-    schedules = Schedule.query.all()
-    return [
-        {
-            'id': schedule.id,
-            'play_music_folder': schedule.play_music_folder,
-            'start_time': schedule.start_time,
-            'end_time': schedule.end_time.split('.')[0] if schedule.end_time else None,  # Remove microseconds
-            'days': schedule.days.split(',')  # Convert to a list of days
-        }
-        for schedule in schedules
-    ]
-
-def play_music(media_folder):
-    """Play music from the specified folder."""
+    return [schedule_to_dict(schedule) for schedule in Schedule.query.all()]
+
+def schedules_running_at(when):
+    """Return the schedules whose slot contains the given datetime, using the (day_mask, start_minute) index."""
+    minute = when.hour * 60 + when.minute
+    today = weekday_bit(when.weekday())
+    yesterday = weekday_bit((when.weekday() - 1) % 7)
+    wraps = db.and_(Schedule.end_minute.isnot(None), Schedule.end_minute <= Schedule.start_minute)
+    same_day = db.and_(Schedule.day_mask.in_(masks_with_day(today)),
+                       Schedule.start_minute <= minute,
+                       db.or_(Schedule.end_minute.is_(None), Schedule.end_minute > minute, wraps))
+    # Slots that run past midnight continue into the next day
+    from_yesterday = db.and_(Schedule.day_mask.in_(masks_with_day(yesterday)), wraps, Schedule.end_minute > minute)
+    return [schedule_to_dict(schedule) for schedule in Schedule.query.filter(db.or_(same_day, from_yesterday))]
+
+def check_conflicts(schedule, exclude_id=None):
+    """Find schedules overlapping a Schedule row; return True if the change should be rejected."""
+    conflict_index = schedule_cache.derived('conflicts', ScheduleConflictIndex)
+    conflicts = conflict_index.find_conflicts(schedule_to_dict(schedule), exclude_id=exclude_id)
+    if not conflicts:
+        return False
+    if app.config['REJECT_SCHEDULE_CONFLICTS']:
+        logger.error(f"Schedule for {schedule.play_music_folder} overlaps schedules {conflicts}, rejected.")
+        return True
+    logger.warning(f"Schedule for {schedule.play_music_folder} overlaps schedules {conflicts}.")
+    return False
+
+# Fire time, dispatch time and lateness of every scheduler trigger
+trigger_recorder = TriggerRecorder()
+
+# Schedule ID -> monotonic time its playlist was queued by pre-roll
+prerolled = {}
+
+# Schedule ID -> monotonic time all of its devices were switched on
+powered_on = {}
+
+# Dashboard view of the schedules, invalidated whenever a schedule changes
+schedule_cache = ScheduleCache(load_schedules_from_db)
+
+def slot_end(end_minute):
+    """datetime of the next occurrence of a slot's end minute, or None if it has no end time."""
+    return next_occurrence(end_minute) if end_minute is not None else None
+
+def queue_media(media_folder, end_minute=None):
+    """Replace the VLC playlist with enough shuffled tracks from the folder for the slot, without starting playback."""
+    selected_media = playback_queue.load(media_folder, slot_end(end_minute))
+    if not selected_media:
+        logger.warning(f"No media files found in folder: {media_folder}")
+        return None
+
+    logger.info(f"Selected media for playback: {selected_media}")
+    return selected_media
+
+def play_music(media_folder, end_minute=None, owner=None):
+    """Play music from the specified folder on behalf of owner, normally a schedule ID."""
     if not vlc.is_vlc_running():
         vlc.start_vlc()
 
-    media_files = glob.glob(os.path.join(media_folder, '*'))
-    logging.info(f"Media files found: {media_files}")
-
-    if media_files:
-        selected_media = random.choice(media_files)
-        logging.info(f"Selected media for playback: {selected_media}")
-        vlc.add_to_playlist(selected_media)
-        vlc.play()
-        logging.info(f"Playing music: {selected_media}")
+    selected_media = queue_media(media_folder, end_minute)
+    if selected_media:
+        vlc.claim(owner)
+        playback_queue.playing()
+        result = vlc.play()
+        logger.info(f"Playing music: {selected_media}")
+        return result
+    return None
+
+def preroll_music(job):
+    """Launch VLC and queue a schedule's playlist ahead of its start so the start only has to send 'play'."""
+    if not vlc.is_vlc_running():
+        vlc.start_vlc()
+    if vlc.is_playing:
+        # Leave the previous slot playing; the start falls back to loading the playlist itself
+        logger.info(f"VLC still playing, pre-roll for {job['play_music_folder']} only warmed up VLC")
+        return
+
+    if queue_media(job['play_music_folder'], job['end_minute']) is None:
+        return
+    if app.config['PLAYBACK_VOLUME'] is not None:
+        vlc.set_volume(app.config['PLAYBACK_VOLUME'])
+    prerolled[job['id']] = time.monotonic()
+    logger.info(f"Pre-rolled {job['play_music_folder']} for {job['start_time']}")
+
+def stop_music(job):
+    """Fade out and stop playback so the final stop lands on the slot's end time.
+
+    Only playback this schedule started is stopped; a schedule that never started,
+    or whose music another start has taken over, leaves VLC alone.
+    """
+    if vlc.owner != job['id']:
+        logger.info(f"Schedule {job['id']} is not playing, nothing to stop")
+        return
+    playback_queue.clear()
+    now = datetime.now()
+    end_at = nearest_occurrence(job['end_minute'], now)  # Today's end, or yesterday's when catching up after midnight
+    remaining = max((end_at - now).total_seconds(), 0.0)
+    result = vlc.fade_out(min(app.config['FADE_OUT_SECONDS'], remaining), time.monotonic() + remaining,
+                          owner=job['id'])
+    if result is not None:
+        trigger_recorder.record_stop(f"schedule_{job['id']}_stop", end_at, result)
+        tracker.refresh()
+
+def device_targets(spec):
+    """Device indexes for a schedule's power_devices, empty if unset or unknown."""
+    if not spec:
+        return []
+    try:
+        return device_manager.targets(spec)
+    except KeyError as e:
+        logger.error(f"Invalid power_devices {spec!r}: {e}")
+        return []
+
+def switch_devices(job, indexes, action):
+    """Switch devices for a schedule concurrently; return True if every device answered."""
+    results = device_manager.command_many(indexes, action)
+    failed = [result['device'] for result in results if not result['ok']]
+    if failed:
+        logger.error(f"Schedule {job['id']} could not {action} devices {failed}")
     else:
-        logging.warning(f"No media files found in folder: {media_folder}")
+        logger.info(f"Schedule {job['id']}: {action} devices {indexes}")
+    return not failed
+
+def power_on(job):
+    """Switch a schedule's devices on ahead of its start so playback never starts into a powered-off amplifier."""
+    indexes = device_targets(job['power_devices'])
+    if indexes and switch_devices(job, indexes, 'turn_on'):
+        powered_on[job['id']] = time.monotonic()
+
+def power_off(job):
+    """Switch a schedule's devices off after its end, keeping those a running schedule still uses."""
+    powered_on.pop(job['id'], None)
+    with app.app_context():
+        running = [other for other in schedules_running_at(datetime.now()) if other['id'] != job['id']]
+    in_use = {index for other in running for index in device_targets(other['power_devices'])}
+    indexes = [index for index in device_targets(job['power_devices']) if index not in in_use]
+    if indexes:
+        switch_devices(job, indexes, 'turn_off')
 
 def schedule_music(job):
-    """Schedule music playback based on the provided job details."""
-    current_day = datetime.now().strftime("%A")
-    current_time = datetime.now().strftime("%H:%M")  # Get current time in HH:MM format
-    logging.info(f"Current day: {current_day}, Current time: {current_time}")
-
-    if current_day in job['days']:
-        logging.info(f"Scheduling music for {current_day}")
-
-        # Check if the current time matches the start time
-        if current_time == job['start_time']:
-            logging.info(f"Time to play music from folder: {job['play_music_folder']}")
-            play_music(job['play_music_folder'])
-        else:
-            logging.info(f"Not the right time to play music. Current: {current_time}, Scheduled: {job['start_time']}")
-
-        if job['end_time']:
-            end_time_str = job['end_time'].split('.')[0]  # Take only 'HH:MM:SS'
-            end_time = datetime.strptime(end_time_str, '%H:%M').time()
-
-            if current_time < end_time.strftime("%H:%M"):
-                days_for_scheduler = convert_days_to_ap_scheduler_format(job['days'])
-                if days_for_scheduler:
-                    stop_job_id = f"stop_{job['start_time']}_{'_'.join(job['days'])}"
-                    # Ensure the stop job is not already scheduled
-                    if not scheduler.get_job(stop_job_id):
-                        scheduler.add_job(stop_music, 'cron',
-                                          day_of_week=days_for_scheduler,
-                                          hour=end_time.hour,
-                                          minute=end_time.minute,
-                                          id=stop_job_id)
-                    else:
-                        logging.warning(f"Stop job {stop_job_id} is already scheduled.")
-                else:
-                    logging.warning("No valid days to schedule stop_music job.")
+    """Start playback for a schedule; its cron trigger only fires on the schedule's days at start_time."""
+    now = datetime.now()
+    current_minute = now.hour * 60 + now.minute
+    end_minute = job['end_minute']
+    if end_minute is not None and job['start_minute'] < end_minute <= current_minute:
+        logger.warning(f"Skipping late trigger for {job['play_music_folder']}: slot ended at {job['end_time']}")
+        return
+
+    scheduled_start = now.replace(hour=job['start_minute'] // 60, minute=job['start_minute'] % 60, second=0, microsecond=0)
+    if scheduled_start > now:  # Slot started yesterday and is being caught up after midnight
+        scheduled_start -= timedelta(days=1)
+
+    powered_at = powered_on.get(job['id'])
+    if job['power_devices'] and (powered_at is None or
+                                 time.monotonic() - powered_at > app.config['POWER_ON_LEAD_SECONDS'] + MISFIRE_GRACE_SECONDS):
+        # The power-on job was missed or failed; switch the devices on before playing into them
+        power_on(job)
+
+    prerolled_at = prerolled.pop(job['id'], None)
+    preroll_window = app.config['PREROLL_SECONDS'] + MISFIRE_GRACE_SECONDS
+    if prerolled_at is not None and time.monotonic() - prerolled_at <= preroll_window and vlc.is_vlc_running():
+        logger.info(f"Starting pre-rolled playlist for {job['play_music_folder']}")
+        vlc.claim(job['id'])
+        playback_queue.playing()
+        result = vlc.play()
+    else:
+        logger.info(f"Time to play music from folder: {job['play_music_folder']}")
+        result = play_music(job['play_music_folder'], job['end_minute'], job['id'])
+    trigger_recorder.record_start(f"schedule_{job['id']}", scheduled_start, result)
+    tracker.refresh()
+
+def schedule_jobs(job):
+    """Return the scheduler jobs a schedule dict needs, keyed on its schedule ID."""
+    # Normalize the music folder path from the job
+    job['play_music_folder'] = normalize_path(job['play_music_folder'])
+
+    trigger = minute_trigger(job['start_minute'], job['day_mask'])
+    if not trigger:  # Ensure that the schedule has at least one day
+        logger.warning(f"No valid days for scheduling job: {job}")
+        return {}
+
+    jobs = {f"schedule_{job['id']}": {'func': schedule_music, 'trigger': trigger, 'args': [job],
+                                      'misfire_grace_time': misfire_grace_for(job)}}
+    if app.config['PREROLL_SECONDS'] > 0:
+        preroll_trigger = offset_trigger(job['start_minute'], job['day_mask'], -app.config['PREROLL_SECONDS'])
+        # A pre-roll missed by more than its lead time is useless; the start loads the playlist instead
+        jobs[f"schedule_{job['id']}_preroll"] = {'func': preroll_music, 'trigger': preroll_trigger, 'args': [job],
+                                                 'misfire_grace_time': app.config['PREROLL_SECONDS']}
+    if job['power_devices']:
+        power_on_trigger = offset_trigger(job['start_minute'], job['day_mask'], -app.config['POWER_ON_LEAD_SECONDS'])
+        jobs[f"schedule_{job['id']}_power_on"] = {'func': power_on, 'trigger': power_on_trigger, 'args': [job],
+                                                  'misfire_grace_time': max(app.config['POWER_ON_LEAD_SECONDS'], 1)}
+    if job['end_minute'] is not None:
+        # A slot ending at or before its start time finishes on the next day
+        stop_mask = job['day_mask'] if job['end_minute'] > job['start_minute'] else shift_mask(job['day_mask'])
+        # Stop jobs missed while down always run on restart so playback never runs on forever
+        # Fire ahead of the end so the fade-out finishes and the final stop lands on end_time
+        stop_trigger = offset_trigger(job['end_minute'], stop_mask, -(app.config['FADE_OUT_SECONDS'] + STOP_LEAD_SECONDS))
+        jobs[f"schedule_{job['id']}_stop"] = {'func': stop_music, 'trigger': stop_trigger, 'args': [job],
+                                              'misfire_grace_time': None}
+        if job['power_devices']:
+            # Like the stop job, always runs on restart so devices do not stay powered all day
+            power_off_trigger = offset_trigger(job['end_minute'], stop_mask, app.config['POWER_OFF_DELAY_SECONDS'])
+            jobs[f"schedule_{job['id']}_power_off"] = {'func': power_off, 'trigger': power_off_trigger, 'args': [job],
+                                                       'misfire_grace_time': None}
+    return jobs
+
+def reconcile_jobs():
+    """Add, update or remove scheduler jobs so they match the schedules in the database."""
+    with app.app_context():
+        schedule_data = load_schedules_from_db()
+    desired = {}
+    for job in schedule_data:
+        desired.update(schedule_jobs(job))
+    return job_reconciler.reconcile(desired)
 
 def main():
     """Main entry point of the application."""
-    global vlc, scheduler
-    vlc = VLCController()
+    global vlc, scheduler, supervisor, job_reconciler, playback_queue, tracker
+    vlc = ThreadedVLCController(startup_timeout=float(os.environ.get('VLC_STARTUP_TIMEOUT', 15)))
     
     # Start VLC without a media file for initial setup
     vlc.start_vlc()
 
-    scheduler = BackgroundScheduler()
-    
-    # Load schedules from the database
-    schedule_data = load_schedules_from_db()
+    # Restart VLC and restore playback if the process or RC socket dies
+    supervisor = VLCSupervisor(vlc)
+    supervisor.start()
 
-    for job in schedule_data:
-        # Normalize the music folder path from the job
-        job['play_music_folder'] = normalize_path(job['play_music_folder'])
-
-        days_for_scheduler = convert_days_to_ap_scheduler_format(job['days'])
-        if days_for_scheduler:  # Ensure that this is not empty
-            job_id = f"{job['start_time']}_{'_'.join(job['days'])}"  # Create a unique ID based on time and days
-            scheduler.add_job(schedule_music, 'cron', 
-                              day_of_week=days_for_scheduler, 
-                              hour=int(job['start_time'].split(':')[0]), 
-                              minute=int(job['start_time'].split(':')[1]),
-                              args=[job],
-                              id=job_id)  # Use the generated ID
-            logging.info(f"Added job: {job_id} for music folder {job['play_music_folder']} at {job['start_time']} on days {job['days']}")
-        else:
-            logging.warning(f"No valid days for scheduling job: {job}")
-
-    scheduler.start()
-    logging.info("Scheduler started")
+    # Polls VLC for the now-playing view; vlc.is_playing follows what VLC reports
+    tracker = PlaybackTracker(vlc)
+    tracker.start()
+
+    media_watcher.start()
+    device_manager.start_polling(app.config['DEVICE_POLL_SECONDS'])
+
+    # Keeps VLC's playlist filled until the end of the running slot
+    playback_queue = PlaybackQueue(vlc, media_index, rotation, tracker)
+    playback_queue.start()
+
+    # Jobs persist in schedules.db so a restart resumes them and catches up on missed
+    # triggers according to each schedule's misfire policy
+    scheduler = BackgroundScheduler(
+        jobstores={'default': SQLAlchemyJobStore(url=DATABASE_URI)},
+        job_defaults={'misfire_grace_time': MISFIRE_GRACE_SECONDS, 'coalesce': True}
+    )
+    trigger_recorder.attach(scheduler)
+
+    # Load the stored jobs paused, then bring them in line with the schedules in the database
+    scheduler.start(paused=True)
+    job_reconciler = JobReconciler(scheduler)
+    reconcile_jobs()
+    scheduler.resume()
+    logger.info("Scheduler started")
 
     try:
         # Keep the Flask app running
         app.run(debug=True, use_reloader=False)
     except Exception as e:
-        logging.error(f"Error in the main loop: {e}")
+        logger.error(f"Error in the main loop: {e}")
     finally:
+        supervisor.stop()
+        tracker.stop()
+        media_watcher.stop()
+        playback_queue.stop()
         vlc.close()  # Close VLC connection on shutdown
+        device_manager.close()
         scheduler.shutdown()  # Shut down the scheduler
 
 @app.route('/')
 def index():
     """Render the main page with scheduled music."""
-    schedules = load_schedules_from_db()
-    return render_template('index.html', schedules=schedules, devices=devices, ranges=range(len(devices)))
+    schedules, schedules_etag = schedule_cache.get()
+    # The page also shows the devices and groups, which reload with the device config
+    device_count, groups = device_manager.count(), device_manager.group_names()
+    etag = hashlib.sha1(json.dumps([schedules_etag, device_count, groups]).encode('utf-8')).hexdigest()
+    if etag in request.if_none_match:
+        return '', 304, {'ETag': f'"{etag}"'}
+
+    response = make_response(render_template('index.html', schedules=schedules, ranges=range(device_count),
+                                             groups=groups))
+    response.set_etag(etag)
+    return response
+
+@app.route('/metrics')
+def metrics_endpoint():
+    """Expose latency histograms and counters in the Prometheus text format."""
+    return Response(metrics.REGISTRY.render(), content_type=metrics.CONTENT_TYPE)
+
+@app.route('/now_playing')
+def now_playing():
+    """Report the cached playback state: state, title, position, length and volume."""
+    return jsonify(tracker.now_playing())
+
+@app.route('/vlc/health')
+def vlc_health():
+    """Report VLC supervisor restart and downtime metrics."""
+    return jsonify(supervisor.metrics())
+
+@app.route('/scheduler/triggers')
+def scheduler_triggers():
+    """Report the most recent trigger fire and dispatch times."""
+    return jsonify(trigger_recorder.recent(request.args.get('limit', 50, type=int)))
+
+@app.route('/scheduler/starts')
+def scheduler_starts():
+    """Report how far recent playback starts were from their scheduled instant."""
+    return jsonify(trigger_recorder.recent_starts(request.args.get('limit', 50, type=int)))
+
+@app.route('/scheduler/stops')
+def scheduler_stops():
+    """Report how far recent final stops landed from their slots' end times."""
+    return jsonify(trigger_recorder.recent_stops(request.args.get('limit', 50, type=int)))
+
+@app.route('/rotation/recent')
+def rotation_recent():
+    """List the most recently played tracks, optionally for one folder."""
+    return jsonify(rotation.recent(request.args.get('limit', 20, type=int), request.args.get('folder')))
 
 @app.route('/add_schedule', methods=['POST'])
 def add_schedule():
@@ -296,24 +481,31 @@ def add_schedule():
     start_time = request.form.get('start_time')
     end_time = request.form.get('end_time')
     days = request.form.getlist('days')
+    misfire_policy = request.form.get('misfire_policy') or None
+    power_devices = schedule_io.normalize_power_devices(request.form.get('power_devices'))
 
-    if not play_music_folder or not start_time:  # Validate the essential fields
-        logging.error("Missing required fields.")
+    if not play_music_folder or not start_time or misfire_policy not in (None,) + MISFIRE_POLICIES:  # Validate the essential fields
+        logger.error("Missing required fields.")
         return redirect(url_for('index'))
 
     # Join the list of days into a comma-separated string
-    days_str = ','.join(days)
-
-    new_schedule = Schedule(
-        play_music_folder=play_music_folder,
-        start_time=start_time,
-        end_time=end_time,
-        days=days_str
-    )
+    new_schedule = Schedule(play_music_folder=play_music_folder, misfire_policy=misfire_policy,
+                            power_devices=power_devices)
+    try:
+        new_schedule.set_times(start_time, end_time, days)
+    except ValueError as e:
+        logger.error(f"Invalid schedule: {e}")
+        return redirect(url_for('index'))
+    days_str = new_schedule.days
+    if check_conflicts(new_schedule):
+        return redirect(url_for('index'))
 
     db.session.add(new_schedule)
     db.session.commit()
-    logging.info(f"Added new schedule: {play_music_folder}, Start: {start_time}, End: {end_time}, Days: {days_str}")
+    schedule_cache.invalidate()
+    reconcile_jobs()
+    media_watcher.mark_dirty(normalize_path(play_music_folder))
+    logger.info(f"Added new schedule: {play_music_folder}, Start: {start_time}, End: {end_time}, Days: {days_str}")
 
     return redirect(url_for('index'))
 
@@ -325,58 +517,120 @@ def edit_schedule():
     start_time = request.form['start_time']
     end_time = request.form['end_time']
     days = request.form.getlist('days')
+    misfire_policy = request.form.get('misfire_policy') or None
+    power_devices = schedule_io.normalize_power_devices(request.form.get('power_devices'))
 
     # Find the schedule by ID and update its fields
     schedule = Schedule.query.get(schedule_id)
     if schedule:
+        # Validate and check the new values before touching the stored row
+        candidate = Schedule(play_music_folder=play_music_folder)
+        try:
+            candidate.set_times(start_time, end_time, days)
+        except ValueError as e:
+            logger.error(f"Invalid schedule: {e}")
+            return redirect(url_for('index'))
+        if check_conflicts(candidate, exclude_id=schedule.id):
+            return redirect(url_for('index'))
+
+        schedule.set_times(start_time, end_time, days)
         schedule.play_music_folder = play_music_folder
-        schedule.start_time = start_time
-        schedule.end_time = end_time
-        schedule.days = ','.join(days)
+        if misfire_policy in MISFIRE_POLICIES:
+            schedule.misfire_policy = misfire_policy
+        schedule.power_devices = power_devices
 
         db.session.commit()
-        logging.info(f"Updated schedule ID: {schedule_id} with new values.")
-
-        job_id = f"{schedule.start_time}_{schedule.days.replace(',', '_')}"
-
-        # Check if the job exists before trying to remove it
-        if scheduler.get_job(job_id):
-            scheduler.remove_job(job_id)
-            logging.info(f"Removed job with ID: {job_id}")
-        else:
-            logging.warning(f"Job with ID: {job_id} not found, cannot remove.")
-
-        # Add new job with updated schedule
-        scheduler.add_job(schedule_music, 'cron',
-                          day_of_week=convert_days_to_ap_scheduler_format(days),
-                          hour=int(start_time.split(":")[0]),
-                          minute=int(start_time.split(":")[1]),
-                          args=[{
-                              'id': schedule.id,
-                              'play_music_folder': play_music_folder,
-                              'start_time': start_time,
-                              'end_time': end_time,
-                              'days': days
-                          }],
-                          id=job_id)  # Unique ID based on time and days
+        schedule_cache.invalidate()
+        media_watcher.mark_dirty(normalize_path(play_music_folder))
+        logger.info(f"Updated schedule ID: {schedule_id} with new values.")
+
+        # Replace the schedule's jobs, found by its ID rather than its old time and days
+        reconcile_jobs()
 
         return redirect(url_for('index'))
     else:
-        logging.warning(f"Schedule ID not found: {schedule_id}")
+        logger.warning(f"Schedule ID not found: {schedule_id}")
         return redirect(url_for('index'))
 
+@app.route('/schedules/import', methods=['POST'])
+def import_schedules():
+    """Bulk import schedules from a JSON or CSV body (or an uploaded 'file') in one transaction."""
+    upload = request.files.get('file')
+    is_csv = upload.filename.lower().endswith('.csv') if upload else request.mimetype == 'text/csv'
+
+    try:
+        # UnicodeDecodeError is a ValueError, so an upload that is not UTF-8 is a 400 as well
+        text = upload.read().decode('utf-8-sig') if upload else request.get_data(as_text=True)
+        rows = schedule_io.parse_csv(text) if is_csv else schedule_io.parse_json(text)
+    except ValueError as e:
+        return jsonify({'error': f"Could not parse schedules: {e}"}), 400
+
+    valid, errors = schedule_io.validate_rows(rows)
+    if errors:
+        return jsonify({'errors': [{'row': number, 'error': message} for number, message in errors]}), 400
+
+    new_schedules = []
+    for row in valid:
+        schedule = Schedule(play_music_folder=row['play_music_folder'], misfire_policy=row['misfire_policy'],
+                            power_devices=row['power_devices'])
+        schedule.set_times(row['start_time'], row['end_time'], row['days'])
+        new_schedules.append(schedule)
+
+    # Same overlap rules as the forms, applied to the stored schedules and the batch's earlier rows
+    conflict_index = schedule_cache.derived('conflicts', ScheduleConflictIndex)
+    conflicts = find_batch_conflicts(conflict_index, [schedule_to_dict(schedule) for schedule in new_schedules])
+    conflict_rows = [{'row': number, 'error': message} for number, message in conflicts]
+    if conflicts and app.config['REJECT_SCHEDULE_CONFLICTS']:
+        logger.error(f"Import rejected, {len(conflicts)} rows overlap other schedules.")
+        return jsonify({'errors': conflict_rows}), 400
+    for number, message in conflicts:
+        logger.warning(f"Imported row {number}: {message}.")
+
+    db.session.add_all(new_schedules)
+    db.session.commit()
+    schedule_cache.invalidate()
+
+    # Register every new job in one pass once the whole batch is committed
+    reconcile_jobs()
+    for schedule in new_schedules:
+        media_watcher.mark_dirty(normalize_path(schedule.play_music_folder))
+    logger.info(f"Imported {len(new_schedules)} schedules.")
+    return jsonify({'imported': len(new_schedules), 'ids': [schedule.id for schedule in new_schedules],
+                    'conflicts': conflict_rows})
+
+@app.route('/schedules/export')
+def export_schedules():
+    """Export every schedule as JSON (default) or CSV in the import format."""
+    schedules, _ = schedule_cache.get()
+    if request.args.get('format') == 'csv':
+        return schedule_io.to_csv(schedules), 200, {
+            'Content-Type': 'text/csv; charset=utf-8',
+            'Content-Disposition': 'attachment; filename=schedules.csv'
+        }
+    return schedule_io.to_json(schedules), 200, {'Content-Type': 'application/json'}
+
+@app.route('/conflicts')
+def conflicts():
+    """List every pair of overlapping schedules and where they overlap."""
+    conflict_index = schedule_cache.derived('conflicts', ScheduleConflictIndex)
+    return jsonify(conflict_index.all_conflicts())
+
 @app.route('/stop_schedule/<int:schedule_id>')
 def stop_schedule(schedule_id):
     """Stop a scheduled music playback by schedule ID."""
     schedule = Schedule.query.get(schedule_id)
     if schedule:
-        # Stop the music if it's currently playing
-        vlc.stop()
+        # Stop the music if this schedule is playing it, and stop topping up its queue
+        if vlc.owner == schedule_id:
+            playback_queue.clear()
+            vlc.stop()
         db.session.delete(schedule)
         db.session.commit()
-        logging.info(f"Stopped and deleted schedule ID: {schedule_id}")
+        schedule_cache.invalidate()
+        reconcile_jobs()
+        logger.info(f"Stopped and deleted schedule ID: {schedule_id}")
     else:
-        logging.warning(f"Schedule ID not found: {schedule_id}")
+        logger.warning(f"Schedule ID not found: {schedule_id}")
 
     return redirect(url_for('index'))
 
@@ -1,22 +1,80 @@
 import os
+import hashlib
 import logging
+import tempfile
+from media_index import MEDIA_EXTENSIONS
 
-# Configure logging
-logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
 
-def create_m3u(directory, output_file_name):
-    output_file= output_file_name+'.m3u'
-    with open(output_file, 'w') as f:
-        # Write the M3U header
-        f.write('#EXTM3U\n')
+HASH_PREFIX = '#X-CONTENT-HASH:'  # Comment line, ignored by players
 
-        # Iterate through all files in the given directory
-        for filename in os.listdir(directory):
-            if filename.endswith('.mp3') or filename.endswith('.mp4'):  # Adjust as needed for other formats
-                file_path = os.path.join(directory, filename)
-                f.write(f'#EXTINF:-1,{filename}\n')  # Use the filename as title
-                f.write(f'{file_path}\n')
 
-    logging.info(f'M3U playlist created: {output_file}')  # Log the message
-    return os.path.abspath(output_file)  # Return the absolute path of the created file
+def m3u_lines(entries):
+    """Yield the #EXTINF/path lines for (path, title, duration) entries."""
+    for file_path, title, duration in entries:
+        seconds = int(round(duration)) if duration else -1
+        yield f'#EXTINF:{seconds},{title}\n'
+        yield f'{file_path}\n'
+
+
+def read_content_hash(output_file):
+    """Return the content hash stored in an existing playlist, or None."""
+    try:
+        with open(output_file, 'r', encoding='utf-8', errors='replace') as f:
+            for _ in range(2):  # The hash is written right after the header
+                line = f.readline()
+                if line.startswith(HASH_PREFIX):
+                    return line[len(HASH_PREFIX):].strip()
+    except OSError:
+        pass
+    return None
+
+
+def write_m3u(output_file, entries):
+    """Atomically write a UTF-8 playlist, skipping the write if its content is unchanged.
+
+    Returns True if the file was (re)written.
+    """
+    entries = list(entries)
+    digest = hashlib.sha256()
+    for line in m3u_lines(entries):
+        digest.update(line.encode('utf-8'))
+    content_hash = digest.hexdigest()
+    if read_content_hash(output_file) == content_hash:
+        return False
 
+    # Stream into a temp file next to the target and rename it into place, so a
+    # crash never leaves a truncated playlist behind.
+    directory = os.path.dirname(os.path.abspath(output_file))
+    fd, temp_path = tempfile.mkstemp(prefix='.m3u-', suffix='.tmp', dir=directory)
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8', newline='\n') as f:
+            f.write('#EXTM3U\n')
+            f.write(f'{HASH_PREFIX}{content_hash}\n')
+            f.writelines(m3u_lines(entries))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, output_file)
+    except BaseException:
+        os.unlink(temp_path)
+        raise
+    return True
+
+
+def create_m3u(directory, output_file_name, media_files=None, media_index=None, extension='.m3u'):
+    output_file = output_file_name + extension
+    if media_files is None:
+        media_files = sorted(os.path.join(directory, filename) for filename in os.listdir(directory))
+
+    def entries():
+        for file_path in media_files:
+            filename = os.path.basename(file_path)
+            if os.path.splitext(filename)[1].lower() in MEDIA_EXTENSIONS:
+                info = media_index.info(file_path) if media_index else None
+                yield file_path, filename, info['duration'] if info else None  # Use the filename as title
+
+    if write_m3u(output_file, entries()):
+        logger.info(f'M3U playlist created: {output_file}')  # Log the message
+    else:
+        logger.info(f'M3U playlist unchanged: {output_file}')
+    return os.path.abspath(output_file)  # Return the absolute path of the created file
@@ -1,21 +1,321 @@
 # device_controller.py
+import os
 import json
-import tinytuya
+import time
 import logging
+import threading
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor, wait
+import tinytuya
+from metrics import DEVICE_COMMAND_SECONDS
+
+logger = logging.getLogger(__name__)
+
+# Used when the DEVICE_CONFIG environment variable is not set
+DEFAULT_CONFIG_PATH = r'C:\Users\admin\OneDrive - DePaul University\OOP\Desktop(1)\Python\python\Project\flask\RC control way\config.json'
+
+_config_cache = {}  # path -> (mtime, parsed config)
+_config_lock = threading.Lock()
+
+
+def device_config_path():
+    """Path of the device config file, from DEVICE_CONFIG or the default."""
+    return os.environ.get('DEVICE_CONFIG', DEFAULT_CONFIG_PATH)
+
+
+def load_device_config(path=None):
+    """Return the parsed device config, re-reading the file only when its mtime changes.
+
+    The same object is returned until the file changes, so callers can detect a
+    reload by identity.
+    """
+    path = path or device_config_path()
+    mtime = os.stat(path).st_mtime
+    with _config_lock:
+        cached = _config_cache.get(path)
+        if cached and cached[0] == mtime:
+            return cached[1]
+        with open(path, 'r') as file:
+            config = json.load(file)
+        _config_cache[path] = (mtime, config)
+    logger.info(f"Loaded device config from {path}: {len(config.get('devices', []))} devices")
+    return config
+
+
+REQUIRED_DEVICE_KEYS = ('dev_id', 'address', 'local_key', 'version')
+
+
+def check_device_config(config):
+    """Raise ValueError unless config has the shape DeviceManager relies on."""
+    if not isinstance(config, dict):
+        raise ValueError("Device config must be an object")
+    entries = config.get('devices', [])
+    if not isinstance(entries, list):
+        raise ValueError("'devices' must be a list")
+    for index, entry in enumerate(entries):
+        if not isinstance(entry, dict):
+            raise ValueError(f"Device {index} must be an object")
+        missing = [key for key in REQUIRED_DEVICE_KEYS if key not in entry]
+        if missing:
+            raise ValueError(f"Device {index} is missing {', '.join(missing)}")
+        if not isinstance(entry['dev_id'], str):
+            raise ValueError(f"Device {index} dev_id must be a string")
+    groups = config.get('groups', {})
+    if not isinstance(groups, dict) or not all(isinstance(members, list) for members in groups.values()):
+        raise ValueError("'groups' must map group names to lists of devices")
+
+
+def make_device(device):
+    """Build the TinyTuya outlet for one config entry."""
+    return tinytuya.OutletDevice(
+        dev_id=device['dev_id'],
+        address=device['address'],
+        local_key=device['local_key'],
+        version=device['version']
+    )
 
-def load_device_config():
-    with open(r'C:\Users\admin\OneDrive - DePaul University\OOP\Desktop(1)\Python\python\Project\flask\RC control way\config.json', 'r') as file:
-        return json.load(file)
 
 def initialize_devices(device_config):
-    devices = []
-    for device in device_config['devices']:
-        d = tinytuya.OutletDevice(
-            dev_id=device['dev_id'],
-            address=device['address'],
-            local_key=device['local_key'],
-            version=device['version']
-        )
-        devices.append(d)
-    logging.info(f"Devices initialized: {len(devices)}")
+    devices = [make_device(device) for device in device_config['devices']]
+    logger.info(f"Devices initialized: {len(devices)}")
     return devices
+
+
+class DeviceManager:
+    """Run TinyTuya commands off the request thread, several devices at a time.
+
+    Each device keeps its socket open between commands and gives up after its own
+    timeout instead of retrying. Commands for one device run one at a time; commands
+    for different devices run concurrently in a bounded thread pool, so a group
+    command takes as long as its slowest device rather than the sum of all of them.
+
+    The config is read through config_loader on first use and checked again on
+    every call, so devices can be added or removed without a restart. Device
+    objects are only built when a device is first used, and are kept across
+    reloads while their config entry is unchanged.
+
+    The last known state of every device is cached: a background poller refreshes
+    it with status() and every command updates it, so readers never touch the
+    network.
+
+    Groups come from the config's optional "groups" mapping of group name to a list
+    of device indexes or device names, e.g. {"amplifiers": [0, "Amp 2"]}.
+    """
+
+    ACTIONS = ('turn_on', 'turn_off')
+
+    def __init__(self, config_loader=load_device_config, max_workers=8, timeout=5.0):
+        self.config_loader = config_loader
+        self.timeout = timeout  # Seconds a single device command may take
+        self._config = None  # Config object the entries below were built from
+        self._rejected = None  # Last config object that failed check_device_config
+        self.config = []  # Device entries, in index order
+        self.groups = {}
+        self._devices = {}  # dev_id -> (config entry, OutletDevice), built on first use
+        self._locks = {}  # dev_id -> lock serializing that device's socket
+        self._states = {}  # dev_id -> last known state
+        self._config_lock = threading.RLock()
+        self._state_lock = threading.Lock()
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='tuya')
+        self._stop_event = threading.Event()
+        self._poller = None
+
+    def _refresh_config(self):
+        """Pick up config file changes; a missing, unparsable or malformed file keeps the last good config."""
+        with self._config_lock:
+            try:
+                config = self.config_loader()
+            except (OSError, ValueError) as e:
+                self._config_failed(e)
+                return
+            if config is self._config or config is self._rejected:
+                return
+            try:
+                check_device_config(config)
+            except ValueError as e:
+                self._rejected = config  # Checked once; the loader returns it again until the file changes
+                self._config_failed(e)
+                return
+
+            entries = config.get('devices', [])
+            ids = {entry['dev_id'] for entry in entries}
+            for dev_id in [dev_id for dev_id in self._devices if dev_id not in ids]:
+                self._close_device(self._devices.pop(dev_id)[1])
+            for entry in entries:
+                self._locks.setdefault(entry['dev_id'], threading.Lock())
+                with self._state_lock:
+                    self._states.setdefault(entry['dev_id'], {'on': None, 'online': None, 'error': None,
+                                                              'updated': None})
+            self._config, self.config = config, entries
+            self.groups = {}
+            for name, members in config.get('groups', {}).items():
+                try:
+                    self.groups[name] = [self.resolve(member) for member in members]
+                except KeyError as e:
+                    logger.error(f"Device group {name}: {e}")
+
+    def _config_failed(self, error):
+        logger.error(f"Cannot load device config, keeping the last good one: {error}", extra={'rate_limit': 300})
+        if self._config is None:
+            self._config = {}
+
+    def count(self):
+        """Number of configured devices."""
+        self._refresh_config()
+        return len(self.config)
+
+    def _device(self, index):
+        """The OutletDevice for an index, built and configured on first use."""
+        with self._config_lock:
+            entry = self.config[index]
+            built = self._devices.get(entry['dev_id'])
+            if built is None or built[0] != entry:
+                if built:
+                    self._close_device(built[1])
+                d = make_device(entry)
+                d.set_socketPersistent(True)
+                d.set_socketTimeout(self.timeout)
+                d.set_socketRetryLimit(1)  # A dead plug fails within one timeout
+                built = self._devices[entry['dev_id']] = (entry, d)
+            return entry['dev_id'], built[1]
+
+    def resolve(self, member):
+        """Device index for an index or a configured device name."""
+        if isinstance(member, int):
+            if not 0 <= member < len(self.config):
+                raise KeyError(f"No device {member}")
+            return member
+        for index, device in enumerate(self.config):
+            if member in (device.get('name'), device['dev_id']):
+                return index
+        raise KeyError(f"Unknown device: {member}")
+
+    def _call(self, index, method):
+        """Call a device method under its lock; return (dev_id, response, error, seconds)."""
+        dev_id, device = self._device(index)
+        with self._locks[dev_id]:
+            started = time.monotonic()
+            try:
+                response = getattr(device, method)()
+            except Exception as e:  # Socket errors surface here with persistent connections
+                response = {'Error': str(e)}
+            elapsed = time.monotonic() - started
+        error = response.get('Error') if isinstance(response, dict) else 'No response'
+        DEVICE_COMMAND_SECONDS.observe(elapsed, method, 'error' if error else 'ok')
+        return dev_id, response, error, elapsed
+
+    def _update_state(self, dev_id, response, error, switched_on=None):
+        with self._state_lock:
+            state = self._states[dev_id]
+            state['updated'] = datetime.now().isoformat()
+            state['online'] = not error
+            state['error'] = error
+            if not error:
+                dps = response.get('dps') or {}
+                if '1' in dps:  # DPS 1 is the outlet's switch
+                    state['on'] = bool(dps['1'])
+                elif switched_on is not None:
+                    state['on'] = switched_on
+
+    def _run(self, index, action):
+        dev_id, response, error, elapsed = self._call(index, action)
+        self._update_state(dev_id, response, error, switched_on=action == 'turn_on')
+        if error:
+            logger.error(f"Device {index} {action} failed after {elapsed:.2f}s: {error}")
+        else:
+            logger.info(f"Device {index} {action} in {elapsed:.2f}s")
+        return {'device': index, 'action': action, 'ok': not error, 'error': error,
+                'seconds': round(elapsed, 3)}
+
+    def _poll(self, index):
+        dev_id, response, error, _ = self._call(index, 'status')
+        self._update_state(dev_id, response, error)
+
+    def poll(self):
+        """Refresh the cached state of every device concurrently."""
+        wait([self._pool.submit(self._poll, index) for index in range(self.count())],
+             timeout=self.timeout + 1)
+
+    def start_polling(self, interval=30.0):
+        """Refresh the state cache in a background thread every interval seconds."""
+        def run():
+            while True:
+                try:
+                    self.poll()
+                except Exception as e:
+                    logger.error(f"Device poller error: {e}", extra={'rate_limit': 300})
+                if self._stop_event.wait(interval):
+                    return
+        self._stop_event.clear()
+        self._poller = threading.Thread(target=run, name="device-poller", daemon=True)
+        self._poller.start()
+
+    def states(self):
+        """Return the cached state of every device without any network access."""
+        self._refresh_config()
+        with self._state_lock:
+            return [{'device': index, 'name': entry.get('name') or entry['dev_id'], **self._states[entry['dev_id']]}
+                    for index, entry in enumerate(self.config)]
+
+    def submit(self, index, action):
+        """Queue a command for one device and return a Future of its result dict."""
+        if action not in self.ACTIONS:
+            raise ValueError(f"Unknown device action: {action}")
+        if not 0 <= index < self.count():
+            raise IndexError(f"No device {index}")
+        return self._pool.submit(self._run, index, action)
+
+    def targets(self, spec):
+        """Device indexes for a group name or a comma-separated list of device indexes/names."""
+        self._refresh_config()
+        if spec in self.groups:
+            return list(self.groups[spec])
+        return [self.resolve(int(member) if member.strip().isdigit() else member.strip())
+                for member in spec.split(',') if member.strip()]
+
+    def command_many(self, indexes, action, timeout=None):
+        """Run an action on several devices concurrently and wait for all of them.
+
+        Devices that have not answered within the timeout are reported as failed.
+        """
+        futures = {self.submit(index, action): index for index in indexes}
+        done, _ = wait(futures, timeout=timeout or self.timeout + 1)
+        results = []
+        for future, index in futures.items():
+            if future in done:
+                results.append(future.result())
+            else:
+                results.append({'device': index, 'action': action, 'ok': False, 'error': 'Timed out',
+                                'seconds': None})
+        return results
+
+    def group_command(self, group, action, timeout=None):
+        """Run an action on every device of a group concurrently and wait for all of them.
+
+        Raises KeyError for an unknown group.
+        """
+        self._refresh_config()
+        return self.command_many(self.groups[group], action, timeout)
+
+    def group_names(self):
+        """Sorted names of the configured groups."""
+        self._refresh_config()
+        return sorted(self.groups)
+
+    @staticmethod
+    def _close_device(device):
+        try:
+            device.close()
+        except Exception:
+            pass
+
+    def close(self):
+        """Stop the poller and worker threads and close the device sockets."""
+        self._stop_event.set()
+        if self._poller:
+            self._poller.join(timeout=self.timeout + 2)
+        self._pool.shutdown(wait=False, cancel_futures=True)
+        with self._config_lock:
+            for _, device in self._devices.values():
+                self._close_device(device)
+            self._devices = {}
@@ -1,54 +1,79 @@
 import os
-from datetime import datetime
+import sys
+import argparse
 from sqlalchemy import create_engine
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy import Column, Integer, String, Time
+from sqlalchemy import Column, Integer, String, Index
 from sqlalchemy.orm import sessionmaker
+from schedule_schema import (parse_time_to_minutes, minutes_to_time_str, days_to_mask, mask_to_days,
+                             migrate_schedule_table, DAY_START_INDEX)
+from schedule_io import validate_rows, parse_json, parse_csv, to_json, to_csv
+from schedule_conflicts import ScheduleConflictIndex, find_batch_conflicts
 
-# Database setup
-DATABASE_URI = 'sqlite:///schedules.db'
+# Database setup: the web apps' 'sqlite:///schedules.db' is resolved by Flask-SQLAlchemy into
+# the instance folder next to them, so the CLI opens that same file
+DATABASE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'instance', 'schedules.db')
+DATABASE_URI = f'sqlite:///{DATABASE_PATH}'
+os.makedirs(os.path.dirname(DATABASE_PATH), exist_ok=True)
+# Refuse imports that overlap existing schedules instead of only warning, like the web apps
+REJECT_SCHEDULE_CONFLICTS = os.environ.get('REJECT_SCHEDULE_CONFLICTS', '0') == '1'
 Base = declarative_base()
 
+# One pooled engine and session factory shared by every helper below
+engine = create_engine(DATABASE_URI)
+Session = sessionmaker(bind=engine)
+
 # Schedule model
 class Schedule(Base):
     __tablename__ = 'schedule'
-    
+
     id = Column(Integer, primary_key=True)
     play_music_folder = Column(String, nullable=False)
-    start_time = Column(Time, nullable=False)
-    end_time = Column(Time, nullable=True)
+    start_time = Column(String(5), nullable=False)  # HH:MM, same format as the web app
+    end_time = Column(String(5), nullable=True)
     days = Column(String, nullable=False)  # Store days as a comma-separated string
+    start_minute = Column(Integer)  # Minutes after midnight
+    end_minute = Column(Integer)
+    day_mask = Column(Integer)  # Bit 0 = Monday ... bit 6 = Sunday
+    misfire_policy = Column(String(10))  # skip, grace or slot; None = grace
+    power_devices = Column(String(200))  # Device group or comma-separated devices; None = none
+
+    __table_args__ = (Index(DAY_START_INDEX, 'day_mask', 'start_minute'),)
 
 # Create the database if it does not exist
 def create_database():
-    if not os.path.exists('schedules.db'):
-        engine = create_engine(DATABASE_URI)
+    if not os.path.exists(DATABASE_PATH):
         Base.metadata.create_all(engine)
         print("Database created.")
     else:
         print("Database already exists.")
+    migrate_schedule_table(engine)
 
-# Function to insert a new schedule
-def insert_schedule(play_music_folder, start_time, end_time, days):
-    engine = create_engine(DATABASE_URI)
-    Session = sessionmaker(bind=engine)
+def build_schedule(play_music_folder, start_time, end_time, days, misfire_policy=None, power_devices=None):
+    """Create a Schedule row with normalized times and days."""
+    # Convert start_time and end_time to minutes after midnight
+    start_minute = parse_time_to_minutes(start_time)
+    end_minute = parse_time_to_minutes(end_time)
+    day_mask = days_to_mask(days)
 
-    # Convert days list to a comma-separated string
-    days_str = ','.join(days)
+    return Schedule(
+        play_music_folder=play_music_folder,
+        start_time=minutes_to_time_str(start_minute),
+        end_time=minutes_to_time_str(end_minute),
+        days=','.join(mask_to_days(day_mask)),  # Store as a plain string
+        start_minute=start_minute,
+        end_minute=end_minute,
+        day_mask=day_mask,
+        misfire_policy=misfire_policy,
+        power_devices=power_devices
+    )
 
+# Function to insert a new schedule
+def insert_schedule(play_music_folder, start_time, end_time, days):
     try:
         with Session() as session:
-            # Convert start_time and end_time to time objects
-            start_time_obj = datetime.strptime(start_time, '%H:%M').time()
-            end_time_obj = datetime.strptime(end_time, '%H:%M').time() if end_time else None
-
             # Create a new schedule entry
-            new_schedule = Schedule(
-                play_music_folder=play_music_folder,
-                start_time=start_time_obj,
-                end_time=end_time_obj,
-                days=days_str  # Store as a plain string
-            )
+            new_schedule = build_schedule(play_music_folder, start_time, end_time, days)
 
             session.add(new_schedule)
             session.commit()
@@ -56,10 +81,55 @@ def insert_schedule(play_music_folder, start_time, end_time, days):
     except Exception as e:
         print(f"Error inserting schedule: {e}")
 
-def delete_schedule(schedule_id):
-    engine = create_engine(DATABASE_URI)
-    Session = sessionmaker(bind=engine)
+def slot_dict(schedule):
+    """The fields of a Schedule row the conflict index works on."""
+    return {'id': schedule.id, 'start_minute': schedule.start_minute, 'end_minute': schedule.end_minute,
+            'day_mask': schedule.day_mask}
+
+def bulk_insert_schedules(rows):
+    """Validate rows and insert them all in one transaction; nothing is inserted if any row is invalid.
+
+    Rows overlapping an existing schedule or an earlier row are reported, and reject
+    the whole import when REJECT_SCHEDULE_CONFLICTS=1.
+    """
+    valid, errors = validate_rows(rows)
+    if errors:
+        for number, message in errors:
+            print(f"Row {number}: {message}")
+        return 0
 
+    schedules = [build_schedule(row['play_music_folder'], row['start_time'], row['end_time'], row['days'],
+                                row['misfire_policy'], row['power_devices'])
+                 for row in valid]
+    with Session() as session:
+        conflict_index = ScheduleConflictIndex([slot_dict(schedule) for schedule in session.query(Schedule)])
+        conflicts = find_batch_conflicts(conflict_index, [slot_dict(schedule) for schedule in schedules])
+        for number, message in conflicts:
+            print(f"Row {number}: {message}")
+        if conflicts and REJECT_SCHEDULE_CONFLICTS:
+            return 0
+
+        session.add_all(schedules)
+        session.commit()
+    print(f"{len(valid)} schedules added.")
+    return len(valid)
+
+def export_schedules():
+    """Return every schedule as a dict in the import format."""
+    with Session() as session:
+        return [
+            {
+                'play_music_folder': schedule.play_music_folder,
+                'start_time': minutes_to_time_str(schedule.start_minute),
+                'end_time': minutes_to_time_str(schedule.end_minute),
+                'days': mask_to_days(schedule.day_mask),
+                'misfire_policy': schedule.misfire_policy,
+                'power_devices': schedule.power_devices,
+            }
+            for schedule in session.query(Schedule).order_by(Schedule.id)
+        ]
+
+def delete_schedule(schedule_id):
     try:
         with Session() as session:
             schedule_to_delete = session.query(Schedule).filter(Schedule.id == schedule_id).first()
@@ -73,9 +143,6 @@ def delete_schedule(schedule_id):
         print(f"Error deleting schedule: {e}")
 
 def delete_all_schedules():
-    engine = create_engine(DATABASE_URI)
-    Session = sessionmaker(bind=engine)
-
     try:
         with Session() as session:
             session.query(Schedule).delete()  # Deletes all rows in the Schedule table
@@ -84,12 +151,47 @@ def delete_all_schedules():
     except Exception as e:
         print(f"Error deleting schedules: {e}")
 
-if __name__ == "__main__":
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Manage music schedules.")
+    subparsers = parser.add_subparsers(dest='command')
+    import_parser = subparsers.add_parser('import', help="Bulk import schedules from a .json or .csv file; a "
+                                                         "running web app picks them up after a restart")
+    import_parser.add_argument('path')
+    export_parser = subparsers.add_parser('export', help="Export schedules to a .json or .csv file ('-' for stdout)")
+    export_parser.add_argument('path')
+    export_parser.add_argument('--format', choices=['json', 'csv'])
+    args = parser.parse_args(argv)
+
     create_database()
+    if args.command == 'import':
+        with open(args.path, encoding='utf-8', newline='') as f:
+            text = f.read()
+        rows = parse_csv(text) if args.path.lower().endswith('.csv') else parse_json(text)
+        imported = bulk_insert_schedules(rows)
+        if imported:
+            # The apps only reconcile jobs and refresh the dashboard on their own routes and at startup
+            print("Restart the web app, or POST the file to /schedules/import instead, to schedule them now.")
+        return 0 if imported or not rows else 1
+
+    if args.command == 'export':
+        csv_format = args.format == 'csv' or (args.format is None and args.path.lower().endswith('.csv'))
+        output = (to_csv if csv_format else to_json)(export_schedules())
+        if args.path == '-':
+            sys.stdout.write(output)
+        else:
+            with open(args.path, 'w', encoding='utf-8', newline='') as f:
+                f.write(output)
+            print(f"Schedules exported to {args.path}.")
+        return 0
+
     # Example usage
     insert_schedule(
-        'C:/Users/admin/OneDrive - DePaul University/OOP/Desktop(1)/mp3/02. Prabhatiya', 
-        '00:03', 
-        '00:15', 
+        'C:/Users/admin/OneDrive - DePaul University/OOP/Desktop(1)/mp3/02. Prabhatiya',
+        '00:03',
+        '00:15',
         ['Monday', 'Friday', 'Thursday']
     )
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,121 @@
+# log_config.py
+import os
+import sys
+import json
+import time
+import queue
+import atexit
+import logging
+import threading
+from datetime import datetime
+from logging.handlers import QueueHandler, QueueListener
+
+TEXT_FORMAT = '%(asctime)s - %(levelname)s - %(name)s - %(message)s'
+
+# LogRecord attributes that are not user extras
+_RECORD_FIELDS = set(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime', 'rate_limit'}
+
+_listener = None
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line with the time, level, logger, message and any extra fields."""
+
+    def format(self, record):
+        entry = {
+            'time': datetime.fromtimestamp(record.created).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'thread': record.threadName,
+            'message': record.getMessage(),
+        }
+        entry.update({key: value for key, value in vars(record).items() if key not in _RECORD_FIELDS})
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+class RateLimitFilter(logging.Filter):
+    """Drop repeats from one call site within a window, then report how many were dropped.
+
+    Only records logged with extra={'rate_limit': seconds} are limited, so chatty
+    call sites opt in and everything else passes untouched.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self._last = {}  # (pathname, lineno) -> (monotonic time last emitted, suppressed count)
+        self._lock = threading.Lock()
+
+    def filter(self, record):
+        interval = getattr(record, 'rate_limit', None)
+        if not interval:
+            return True
+        key = (record.pathname, record.lineno)
+        now = time.monotonic()
+        with self._lock:
+            last, suppressed = self._last.get(key, (None, 0))
+            if last is not None and now - last < interval:
+                self._last[key] = (last, suppressed + 1)
+                return False
+            self._last[key] = (now, 0)
+        if suppressed:
+            record.suppressed = suppressed
+            record.msg = f"{record.msg} ({suppressed} similar messages suppressed)"
+        return True
+
+
+def summarize(items, limit=5):
+    """Short description of a possibly large list for a log line: count plus the first few items."""
+    items = list(items)
+    shown = ', '.join(str(item) for item in items[:limit])
+    more = f", ... (+{len(items) - limit} more)" if len(items) > limit else ''
+    return f"{len(items)} items: {shown}{more}"
+
+
+def parse_levels(spec):
+    """Parse 'module=LEVEL,other=LEVEL' into a dict, ignoring malformed entries."""
+    levels = {}
+    for part in (spec or '').split(','):
+        name, _, level = part.partition('=')
+        if name.strip() and level.strip():
+            levels[name.strip()] = level.strip().upper()
+    return levels
+
+
+def setup_logging(level=None, module_levels=None, json_format=None):
+    """Route all logging through a queue so formatting and console I/O happen on a listener thread.
+
+    Defaults come from the environment:
+      LOG_LEVEL   root level (INFO)
+      LOG_LEVELS  per-module levels, e.g. 'vlc_controller=WARNING,rc_client=DEBUG'
+      LOG_FORMAT  'json' (default) or 'text'
+    """
+    global _listener
+    if _listener is not None:
+        return _listener
+
+    level = level or os.environ.get('LOG_LEVEL', 'INFO').upper()
+    module_levels = module_levels if module_levels is not None else parse_levels(os.environ.get('LOG_LEVELS'))
+    if json_format is None:
+        json_format = os.environ.get('LOG_FORMAT', 'json').lower() != 'text'
+
+    console = logging.StreamHandler(sys.stderr)
+    console.setFormatter(JsonFormatter() if json_format else logging.Formatter(TEXT_FORMAT))
+
+    log_queue = queue.SimpleQueue()
+    queue_handler = QueueHandler(log_queue)
+    queue_handler.addFilter(RateLimitFilter())  # Suppressed records never reach the queue
+
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(queue_handler)
+    root.setLevel(level)
+    for name, module_level in module_levels.items():
+        logging.getLogger(name).setLevel(module_level)
+
+    _listener = QueueListener(log_queue, console, respect_handler_level=True)
+    _listener.start()
+    atexit.register(_listener.stop)
+    return _listener
@@ -0,0 +1,151 @@
+# media_index.py
+import os
+import random
+import logging
+import threading
+from sqlalchemy import create_engine, Column, Integer, Float, String
+from sqlalchemy.orm import declarative_base, sessionmaker
+from metrics import MEDIA_SCAN_SECONDS
+
+try:
+    from mutagen import File as MutagenFile  # Optional, used to read track durations
+except ImportError:
+    MutagenFile = None
+
+logger = logging.getLogger(__name__)
+
+DATABASE_URI = 'sqlite:///schedules.db'
+MEDIA_EXTENSIONS = ('.mp3', '.mp4', '.m4a', '.aac', '.wav', '.ogg', '.oga', '.opus', '.flac', '.wma')
+
+Base = declarative_base()
+
+
+class MediaFolder(Base):
+    __tablename__ = 'media_folder'
+
+    path = Column(String, primary_key=True)
+    mtime = Column(Float, nullable=False)  # Directory mtime at the last scan
+
+
+class MediaFile(Base):
+    __tablename__ = 'media_file'
+
+    path = Column(String, primary_key=True)
+    folder = Column(String, nullable=False, index=True)
+    size = Column(Integer, nullable=False)
+    mtime = Column(Float, nullable=False)
+    extension = Column(String(10), nullable=False)
+    duration = Column(Float, nullable=True)  # Seconds, None if unknown
+
+
+def read_duration(path):
+    """Return the duration of a media file in seconds, or None if it cannot be read."""
+    if MutagenFile is None:
+        return None
+    try:
+        media = MutagenFile(path)
+        return float(media.info.length) if media is not None and media.info else None
+    except Exception as e:
+        logger.warning(f"Could not read duration of {path}: {e}")
+        return None
+
+
+class MediaIndex:
+    """Persistent index of media files per folder, refreshed only when a folder's mtime changes."""
+
+    def __init__(self, database_uri=DATABASE_URI):
+        self.engine = create_engine(database_uri)
+        Base.metadata.create_all(self.engine)
+        self.Session = sessionmaker(bind=self.engine)
+        self._folders = {}  # folder -> {'mtime': float, 'files': {path: MediaFile fields}}
+        self._lock = threading.RLock()
+
+    def _load(self, folder):
+        """Load a folder's cached entries from the database."""
+        with self.Session() as session:
+            record = session.get(MediaFolder, folder)
+            rows = session.query(MediaFile).filter(MediaFile.folder == folder).all()
+            files = {
+                row.path: {'size': row.size, 'mtime': row.mtime, 'extension': row.extension,
+                           'duration': row.duration}
+                for row in rows
+            }
+        return {'mtime': record.mtime if record else None, 'files': files, 'paths': sorted(files)}
+
+    def refresh(self, folder, force=False):
+        """Rescan a folder if its directory mtime changed since the last scan."""
+        folder = os.path.normpath(folder)
+        with self._lock:
+            entry = self._folders.get(folder)
+            if entry is None:
+                entry = self._folders[folder] = self._load(folder)
+
+            try:
+                folder_mtime = os.stat(folder).st_mtime
+            except OSError as e:
+                logger.error(f"Cannot read media folder {folder}: {e}", extra={'rate_limit': 300})
+                return False
+            if not force and entry['mtime'] == folder_mtime:
+                return False
+
+            with MEDIA_SCAN_SECONDS.time():
+                self._scan(folder, folder_mtime, entry)
+            return True
+
+    def _scan(self, folder, folder_mtime, entry):
+        """Diff the folder listing against the cached entries and persist the changes."""
+        seen = {}
+        with os.scandir(folder) as it:
+            for dir_entry in it:
+                extension = os.path.splitext(dir_entry.name)[1].lower()
+                if extension in MEDIA_EXTENSIONS and dir_entry.is_file():
+                    stat = dir_entry.stat()
+                    seen[dir_entry.path] = (stat.st_size, stat.st_mtime, extension)
+
+        cached = entry['files']
+        removed = [path for path in cached if path not in seen]
+        changed = [path for path, (size, mtime, _) in seen.items()
+                   if path not in cached or cached[path]['size'] != size or cached[path]['mtime'] != mtime]
+
+        with self.Session() as session:
+            if removed:
+                session.query(MediaFile).filter(MediaFile.path.in_(removed)).delete(synchronize_session=False)
+            for path in changed:
+                size, mtime, extension = seen[path]
+                fields = {'size': size, 'mtime': mtime, 'extension': extension, 'duration': read_duration(path)}
+                session.merge(MediaFile(path=path, folder=folder, **fields))
+                cached[path] = fields
+            session.merge(MediaFolder(path=folder, mtime=folder_mtime))
+            session.commit()
+
+        for path in removed:
+            del cached[path]
+        entry['mtime'] = folder_mtime
+        entry['paths'] = sorted(cached)
+        logger.info(f"Media index refreshed for {folder}: {len(cached)} files, "
+                     f"{len(changed)} added/changed, {len(removed)} removed")
+
+    def files(self, folder, refresh=True):
+        """Return the sorted media paths in a folder from the index."""
+        folder = os.path.normpath(folder)
+        with self._lock:
+            if refresh or folder not in self._folders:
+                self.refresh(folder)
+            entry = self._folders.get(folder)
+            return list(entry['paths']) if entry else []
+
+    def info(self, path):
+        """Return the cached size, mtime, extension and duration for a media path."""
+        path = os.path.normpath(path)
+        with self._lock:
+            entry = self._folders.get(os.path.dirname(path))
+            return entry['files'].get(path) if entry else None
+
+    def pick_random(self, folder, refresh=True):
+        """Pick a random media path from a folder without listing the filesystem."""
+        folder = os.path.normpath(folder)
+        with self._lock:
+            if refresh or folder not in self._folders:
+                self.refresh(folder)
+            entry = self._folders.get(folder)
+            return random.choice(entry['paths']) if entry and entry['paths'] else None
@@ -0,0 +1,151 @@
+# media_watcher.py
+import os
+import hashlib
+import logging
+import threading
+from create_m3u_file import create_m3u
+
+try:
+    from watchdog.observers import Observer  # Optional, native change notifications
+    from watchdog.events import FileSystemEventHandler
+except ImportError:
+    Observer = None
+    FileSystemEventHandler = object
+
+logger = logging.getLogger(__name__)
+
+
+class _DirtyHandler(FileSystemEventHandler):
+    """Mark a watched folder dirty whenever watchdog reports a change in it."""
+
+    def __init__(self, watcher, folder):
+        self.watcher = watcher
+        self.folder = folder
+
+    def on_any_event(self, event):
+        self.watcher.mark_dirty(self.folder)
+
+
+def playlist_name(folder):
+    """Name of the M3U playlist generated for a media folder.
+
+    The folder's name is followed by a hash of its full path, so folders with the
+    same name in different places get separate playlists.
+    """
+    folder = os.path.normcase(os.path.abspath(folder))
+    digest = hashlib.sha1(folder.encode('utf-8')).hexdigest()[:10]
+    return f"{os.path.basename(folder) or 'playlist'}-{digest}"
+
+
+class MediaWatcher:
+    """Keep the media index and each schedule folder's M3U playlist up to date in the background.
+
+    Folders come from folders_provider (normally every folder in the Schedule table).
+    Change detection uses watchdog when it is installed and falls back to polling
+    each folder's directory mtime. Only playlists of changed folders are rebuilt.
+    """
+
+    def __init__(self, media_index, folders_provider, interval=30.0, build_playlists=True):
+        self.media_index = media_index
+        self.folders_provider = folders_provider
+        self.interval = interval  # Seconds between polls
+        self.build_playlists = build_playlists
+        self._prepared = {}  # folder -> (directory mtime, playlist path)
+        self._dirty = set()
+        self._watches = {}  # folder -> watchdog watch handle
+        self._observer = None
+        self._lock = threading.RLock()
+        self._wakeup = threading.Event()
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    def start(self):
+        """Start watching in a background thread."""
+        if Observer is not None:
+            self._observer = Observer()
+            self._observer.start()
+        else:
+            logger.info("watchdog not installed, polling media folders for changes.")
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, name="media-watcher", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Stop the watcher thread and any native observer."""
+        self._stop_event.set()
+        self._wakeup.set()
+        if self._thread:
+            self._thread.join(timeout=5)
+        if self._observer:
+            self._observer.stop()
+            self._observer.join(timeout=5)
+            self._observer = None
+
+    def mark_dirty(self, folder):
+        """Flag a folder for rebuilding and wake the watcher thread."""
+        with self._lock:
+            self._dirty.add(folder)
+        self._wakeup.set()
+
+    def _run(self):
+        while not self._stop_event.is_set():
+            try:
+                self.sync()
+            except Exception as e:
+                logger.error(f"Media watcher error: {e}")
+            self._wakeup.wait(self.interval)
+            self._wakeup.clear()
+
+    def _folders(self):
+        return {os.path.normpath(folder) for folder in self.folders_provider()}
+
+    def sync(self):
+        """Track the current folder set and rebuild whatever changed."""
+        folders = self._folders()
+        with self._lock:
+            for folder in set(self._prepared) - folders:
+                del self._prepared[folder]
+            self._update_watches(folders)
+            if self._observer is not None:
+                # Native notifications tell us what changed, only new folders need a check
+                candidates = {folder for folder in folders if folder not in self._prepared} | (self._dirty & folders)
+            else:
+                candidates = folders
+            self._dirty &= folders
+
+        for folder in candidates:
+            self.prepare(folder)
+
+    def _update_watches(self, folders):
+        if self._observer is None:
+            return
+        for folder in set(self._watches) - folders:
+            self._observer.unschedule(self._watches.pop(folder))
+        for folder in folders - set(self._watches):
+            if os.path.isdir(folder):
+                self._watches[folder] = self._observer.schedule(_DirtyHandler(self, folder), folder, recursive=False)
+
+    def prepare(self, folder):
+        """Return the folder's playlist path, refreshing the index and playlist only if the folder changed."""
+        folder = os.path.normpath(folder)
+        try:
+            folder_mtime = os.stat(folder).st_mtime
+        except OSError as e:
+            logger.error(f"Cannot read media folder {folder}: {e}", extra={'rate_limit': 300})
+            return None
+
+        with self._lock:
+            prepared = self._prepared.get(folder)
+            if prepared and prepared[0] == folder_mtime and folder not in self._dirty:
+                return prepared[1]
+
+            # A dirty folder had a change that may not show in its directory mtime
+            self.media_index.refresh(folder, force=folder in self._dirty)
+            media_files = self.media_index.files(folder, refresh=False)
+            m3u_file = None
+            if self.build_playlists and media_files:
+                m3u_file = create_m3u(folder, playlist_name(folder), media_files,
+                                      media_index=self.media_index, extension='.m3u8')
+            self._prepared[folder] = (folder_mtime, m3u_file)
+            self._dirty.discard(folder)
+            return m3u_file
@@ -0,0 +1,167 @@
+# metrics.py
+import time
+import threading
+from bisect import bisect_left
+
+# Upper bounds in seconds, from sub-millisecond RC replies up to slow VLC starts
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+
+class Histogram:
+    """Cumulative bucket histogram, one series per combination of label values."""
+
+    type = 'histogram'
+
+    def __init__(self, name, help_text, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._series = {}  # label values -> [bucket counts..., +Inf count, sum]
+        self._lock = threading.Lock()
+
+    def observe(self, value, *labelvalues):
+        """Record one observation for the given label values."""
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labelvalues)
+            if series is None:
+                series = self._series[labelvalues] = [0] * (len(self.buckets) + 1) + [0.0]
+            series[index] += 1
+            series[-1] += value
+
+    def time(self, *labelvalues):
+        """Context manager observing the duration of its block."""
+        return _Timer(self, labelvalues)
+
+    def samples(self):
+        with self._lock:
+            series = {labels: list(values) for labels, values in self._series.items()}
+        lines = []
+        for labels, values in sorted(series.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), values):
+                cumulative += count
+                le = ('le', '+Inf' if bound == float('inf') else repr(bound))
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, labels, [le])} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, labels)} {values[-1]!r}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, labels)} {cumulative}")
+        return lines
+
+
+class Counter:
+    """Monotonic counter, one series per combination of label values."""
+
+    type = 'counter'
+
+    def __init__(self, name, help_text, labelnames=()):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *labelvalues, amount=1):
+        with self._lock:
+            self._series[labelvalues] = self._series.get(labelvalues, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            series = dict(self._series)
+        return [f"{self.name}{_format_labels(self.labelnames, labels)} {value}"
+                for labels, value in sorted(series.items())]
+
+
+class _Timer:
+    def __init__(self, histogram, labelvalues):
+        self.histogram = histogram
+        self.labelvalues = labelvalues
+
+    def __enter__(self):
+        self.started = time.monotonic()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.histogram.observe(time.monotonic() - self.started, *self.labelvalues)
+
+
+class Registry:
+    """Collection of metrics rendered together in the Prometheus text format."""
+
+    def __init__(self):
+        self._metrics = []
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        with self._lock:
+            self._metrics.append(metric)
+        return metric
+
+    def render(self):
+        """Return every metric in the Prometheus text exposition format (version 0.0.4)."""
+        with self._lock:
+            metrics = list(self._metrics)
+        lines = []
+        for metric in metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.type}")
+            lines.extend(metric.samples())
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+RC_COMMAND_SECONDS = REGISTRY.register(Histogram(
+    'vlc_rc_command_seconds', 'Round trip from writing a VLC RC command to reading its reply.', ['command']))
+VLC_STARTUP_SECONDS = REGISTRY.register(Histogram(
+    'vlc_startup_seconds', 'Time from spawning VLC until its RC interface answers.'))
+SCHEDULER_LATENESS_SECONDS = REGISTRY.register(Histogram(
+    'scheduler_fire_lateness_seconds', 'Delay between a job trigger\'s scheduled time and its dispatch.', ['job']))
+SCHEDULER_MISSED_TOTAL = REGISTRY.register(Counter(
+    'scheduler_missed_total', 'Job triggers dropped because they were later than their misfire grace.', ['job']))
+PLAYBACK_OFFSET_SECONDS = REGISTRY.register(Histogram(
+    'playback_offset_seconds', 'How far playback starts and final stops landed from their scheduled instant.',
+    ['event']))
+MEDIA_SCAN_SECONDS = REGISTRY.register(Histogram(
+    'media_scan_seconds', 'Duration of media folder rescans.'))
+DEVICE_COMMAND_SECONDS = REGISTRY.register(Histogram(
+    'device_command_seconds', 'Duration of TinyTuya device commands.', ['action', 'result']))
+HTTP_REQUEST_SECONDS = REGISTRY.register(Histogram(
+    'http_request_seconds', 'Time spent in Flask request handlers.', ['endpoint', 'method', 'status']))
+
+
+def job_kind(job_id):
+    """Label for a scheduler job ID with the schedule ID removed, e.g. 'schedule_7_stop' -> 'stop'."""
+    parts = job_id.split('_', 2)
+    if len(parts) >= 2 and parts[0] == 'schedule' and parts[1].isdigit():
+        return parts[2] if len(parts) == 3 else 'start'
+    return job_id
+
+
+def instrument_app(app):
+    """Time every Flask request by endpoint, method and status."""
+    from flask import g, request
+
+    @app.before_request
+    def _start_timer():
+        g.metrics_started = time.monotonic()
+
+    @app.after_request
+    def _observe(response):
+        started = g.pop('metrics_started', None)
+        if started is not None:
+            HTTP_REQUEST_SECONDS.observe(time.monotonic() - started, request.endpoint or 'unknown',
+                                         request.method, str(response.status_code))
+        return response
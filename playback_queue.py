@@ -0,0 +1,173 @@
+# playback_queue.py
+import logging
+import threading
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+
+class PlaybackQueue:
+    """Keep VLC's playlist filled for the rest of a schedule slot, a few tracks at a time.
+
+    Tracks come from the folder's persisted rotation and are queued with 'enqueue' until
+    they cover the lookahead window. A background thread follows VLC's real playback
+    through the PlaybackTracker: every track start it reports moves the play position
+    one queued track on, and the music still ahead is the current track's real
+    remaining time plus the estimated durations of the tracks not yet started. The
+    queue is topped up while that falls short of the lookahead, and only stops growing
+    once it reaches the slot's end time on the clock. If VLC stops before the slot
+    ends, a fresh queue is loaded and played. When the whole folder fits in the slot
+    it is queued once and VLC's 'loop' repeats it instead.
+    """
+
+    def __init__(self, vlc, media_index, rotation, tracker, lookahead=600.0, default_duration=240.0, interval=15.0):
+        self.vlc = vlc
+        self.media_index = media_index
+        self.rotation = rotation  # RotationState choosing the order tracks are queued in
+        self.tracker = tracker  # PlaybackTracker reporting VLC's play position
+        self.lookahead = lookahead  # Seconds of music to keep queued ahead of the play position
+        self.default_duration = default_duration  # Assumed length of tracks without a known duration
+        self.interval = interval  # Seconds between top-up checks
+        self._folder = None  # Folder being topped up, None when idle or looping
+        self._end_at = None  # datetime the slot ends, None if it has no end time
+        self._pending = []  # Estimated durations of queued tracks VLC has not started yet
+        self._current = None  # Estimated duration of the track VLC is playing
+        self._track_starts = None  # Tracker's track_starts last accounted for, None until playing
+        self._seen_playing = False  # VLC reported playback since playing() was called
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    def start(self):
+        """Start the top-up thread."""
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, name="playback-queue", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Stop the top-up thread."""
+        self._stop_event.set()
+        if self._thread:
+            self._thread.join(timeout=5)
+
+    def duration(self, path):
+        """Track length in seconds from the media index, or the default if unknown."""
+        info = self.media_index.info(path)
+        return (info and info.get('duration')) or self.default_duration
+
+    def _slot_seconds(self):
+        if self._end_at is None:
+            return None
+        return max((self._end_at - datetime.now()).total_seconds(), 0.0)
+
+    def load(self, folder, end_at=None):
+        """Replace the VLC playlist with the start of a slot's queue without starting playback.
+
+        Returns the first queued path, or None if the folder has no media.
+        """
+        paths = self.media_index.files(folder)
+        if not paths:
+            return None
+
+        with self._lock:
+            self._folder, self._end_at = folder, end_at
+            self._pending, self._current = [], None
+            self._track_starts, self._seen_playing = None, False
+            self.vlc.clear_playlist()
+            self.vlc.set_random(False)  # The rotation decides the order so top-ups append in order
+
+            slot_seconds = self._slot_seconds()
+            total = sum(self.duration(path) for path in paths)
+            if slot_seconds is not None and total <= slot_seconds:
+                # Whole folder fits in the slot: queue it once and let VLC repeat it
+                order = self.rotation.whole_pass(folder)
+                if not order:
+                    return None
+                self.vlc.set_loop(True)
+                self.vlc.enqueue_many(order)
+                self._folder = None
+                logger.info(f"Queued all {len(order)} tracks from {folder} on loop")
+                return order[0]
+
+            self.vlc.set_loop(False)
+            first = self._fill(0.0)
+            queued = sum(self._pending)
+        logger.info(f"Queued {queued:.0f}s of music from {folder}")
+        return first
+
+    def playing(self):
+        """Mark the loaded queue as playing; the play position is followed from here.
+
+        Call just before sending 'play', so the tracker counts the first track's start.
+        """
+        with self._lock:
+            if self._folder is not None:
+                self._track_starts = self.tracker.now_playing()['track_starts']
+
+    def clear(self):
+        """Stop topping up the queue, e.g. when the slot is stopped."""
+        with self._lock:
+            self._folder = None
+            self._track_starts = None
+
+    def _fill(self, ahead):
+        """Enqueue tracks until ahead seconds of music grow to the lookahead, capped at the slot's end."""
+        target = self.lookahead
+        slot_seconds = self._slot_seconds()
+        if slot_seconds is not None:
+            target = min(target, slot_seconds)
+        batch = []
+        while ahead < target:
+            track = self.rotation.next(self._folder)
+            if track is None:
+                break
+            batch.append(track)
+            self._pending.append(self.duration(track))
+            ahead += self._pending[-1]
+        if batch:
+            self.vlc.enqueue_many(batch)
+        return batch[0] if batch else None
+
+    def _ahead(self, state):
+        """Seconds of music queued from VLC's current play position."""
+        starts = state['track_starts'] - self._track_starts
+        self._track_starts = state['track_starts']
+        for _ in range(min(starts, len(self._pending))):
+            self._current = self._pending.pop(0)
+        if state['state'] in ('playing', 'paused'):
+            self._seen_playing = True
+            if state['remaining'] is not None:
+                return state['remaining'] + sum(self._pending)
+        return (self._current or 0.0) + sum(self._pending)
+
+    def _restart(self):
+        """Load and play a fresh queue after VLC stopped before the slot's end."""
+        self.vlc.clear_playlist()
+        self._pending, self._current, self._seen_playing = [], None, False
+        first = self._fill(0.0)
+        if first is None:
+            return None
+        self._track_starts = self.tracker.now_playing()['track_starts']  # Before 'play' so its start is counted
+        self.vlc.play()
+        return first
+
+    def _run(self):
+        while not self._stop_event.wait(self.interval):
+            with self._lock:
+                if self._folder is None or self._track_starts is None:
+                    continue
+                state = self.tracker.now_playing()
+                slot_seconds = self._slot_seconds()
+                started = self._seen_playing or state['track_starts'] > self._track_starts
+                if started and state['state'] == 'stopped' and (slot_seconds is None or slot_seconds > 1):
+                    # The queue ran out or VLC was stopped by hand before the slot's end
+                    restarted = self._restart()
+                    if restarted:
+                        logger.warning(f"VLC stopped before the end of the slot, restarted {self._folder}")
+                    continue
+                added = self._fill(self._ahead(state))
+                folder, queued = self._folder, sum(self._pending)
+            if added:
+                logger.info(f"Topped up playback queue, {queued:.0f}s queued ahead from {folder}")
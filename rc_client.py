@@ -0,0 +1,72 @@
+# rc_client.py
+import socket
+import time
+import logging
+from metrics import RC_COMMAND_SECONDS
+
+logger = logging.getLogger(__name__)
+
+# VLC's RC interface ends every reply (and the connect banner) with this prompt
+RC_PROMPT = b'> '
+
+# Unsolicited notices VLC prints between replies, e.g. "status change: ( play state: 3 ): Play"
+STATUS_CHANGE_PREFIX = 'status change:'
+
+
+class RCClient:
+    """Buffered client for the VLC RC protocol that frames replies on the prompt."""
+
+    def __init__(self, sock, timeout=5.0, encoding='utf-8'):
+        self.sock = sock
+        self.timeout = timeout
+        self.encoding = encoding
+        self._buffer = b''
+
+    def _find_prompt(self):
+        """Return the index of a prompt at the start of a line in the buffer, or -1."""
+        if self._buffer.startswith(RC_PROMPT):
+            return 0
+        index = self._buffer.find(b'\n' + RC_PROMPT)
+        return index + 1 if index != -1 else -1
+
+    def read_reply(self, timeout=None):
+        """Read one prompt-terminated reply and return it without the prompt or status change notices."""
+        self.sock.settimeout(self.timeout if timeout is None else timeout)
+        index = self._find_prompt()
+        while index == -1:
+            chunk = self.sock.recv(4096)
+            if not chunk:
+                raise ConnectionError("VLC closed the RC connection")
+            self._buffer += chunk
+            index = self._find_prompt()
+
+        reply = self._buffer[:index]
+        self._buffer = self._buffer[index + len(RC_PROMPT):]
+        lines = reply.decode(self.encoding, 'replace').splitlines()
+        return '\n'.join(line for line in lines if not line.strip().startswith(STATUS_CHANGE_PREFIX)).strip()
+
+    def send(self, command):
+        """Send a single command and return its reply."""
+        return self.send_many([command])[0]
+
+    def send_many(self, commands):
+        """Pipeline several commands in one write and return their replies in order."""
+        if not commands:
+            return []
+        payload = ''.join(f"{command}\n" for command in commands)
+        started = time.monotonic()
+        self.sock.sendall(payload.encode(self.encoding))
+        replies = []
+        for command in commands:
+            replies.append(self.read_reply())
+            # Labelled by verb only so file paths do not become separate series
+            RC_COMMAND_SECONDS.observe(time.monotonic() - started, command.split(' ', 1)[0])
+        return replies
+
+    def close(self):
+        """Close the underlying socket."""
+        try:
+            self.sock.close()
+        except socket.error as e:
+            logger.error(f"Error closing RC socket: {e}")
+        self._buffer = b''
@@ -0,0 +1,171 @@
+# rotation.py
+import os
+import json
+import random
+import logging
+import threading
+from datetime import datetime
+from sqlalchemy import create_engine, Column, Integer, String, Text, DateTime
+from sqlalchemy.orm import declarative_base, sessionmaker
+
+logger = logging.getLogger(__name__)
+
+DATABASE_URI = 'sqlite:///schedules.db'
+
+HISTORY_ROWS = 5000  # Newest play history rows kept; older ones are pruned
+PRUNE_EVERY = 200  # History rows added between prunes
+
+Base = declarative_base()
+
+
+class FolderRotation(Base):
+    __tablename__ = 'folder_rotation'
+
+    folder = Column(String, primary_key=True)
+    seed = Column(Integer, nullable=False)
+    pass_number = Column(Integer, nullable=False)  # Passes started over the folder, from 0
+    track_order = Column(Text, nullable=False)  # JSON list, the current pass's permutation
+    cursor = Column(Integer, nullable=False)  # Index of the next track in track_order
+
+
+class PlayHistory(Base):
+    __tablename__ = 'play_history'
+
+    id = Column(Integer, primary_key=True)
+    folder = Column(String, nullable=False, index=True)
+    path = Column(String, nullable=False)
+    played_at = Column(DateTime, nullable=False, index=True)
+
+
+class RotationState:
+    """Per-folder shuffle that plays every track once before any track repeats.
+
+    Each folder has a seed; pass N plays the folder in the order of a permutation
+    drawn from (seed, N). The permutation and a cursor into it are stored in
+    schedules.db, so rotation continues where it left off across triggers, days and
+    restarts. Picking the next track is a cursor step over the in-memory permutation;
+    the folder listing is only read again when a new pass starts.
+    """
+
+    def __init__(self, media_index, database_uri=DATABASE_URI):
+        self.media_index = media_index
+        self.engine = create_engine(database_uri)
+        Base.metadata.create_all(self.engine)
+        self.Session = sessionmaker(bind=self.engine)
+        self._rotations = {}  # folder -> {'seed', 'pass_number', 'order', 'cursor', 'stored'}
+        self._unpruned = PRUNE_EVERY  # History rows added since the last prune; prune on first use
+        self._lock = threading.Lock()
+
+    def _load(self, folder):
+        with self.Session() as session:
+            record = session.get(FolderRotation, folder)
+            if record:
+                return {'seed': record.seed, 'pass_number': record.pass_number,
+                        'order': json.loads(record.track_order), 'cursor': record.cursor, 'stored': True}
+        state = {'seed': random.getrandbits(31), 'pass_number': -1, 'order': [], 'cursor': 0, 'stored': False}
+        self._new_pass(folder, state)
+        return state
+
+    def _new_pass(self, folder, state):
+        """Draw the next pass's permutation from the folder's current listing."""
+        paths = self.media_index.files(folder, refresh=False)
+        state['pass_number'] += 1
+        state['order'] = random.Random(f"{state['seed']}:{state['pass_number']}").sample(paths, len(paths))
+        state['cursor'] = 0
+
+    def _state(self, folder):
+        state = self._rotations.get(folder)
+        if state is None:
+            self.media_index.files(folder, refresh=False)  # Load the folder's index entries once
+            state = self._rotations[folder] = self._load(folder)
+        return state
+
+    def _store(self, session, folder, state, new_pass, played):
+        """Persist the rotation state and add the played tracks to the history."""
+        if new_pass or not state['stored']:
+            session.merge(FolderRotation(folder=folder, seed=state['seed'], pass_number=state['pass_number'],
+                                         track_order=json.dumps(state['order']), cursor=state['cursor']))
+            state['stored'] = True
+        else:
+            # Mid-pass only the cursor moves
+            session.query(FolderRotation).filter(FolderRotation.folder == folder).update({'cursor': state['cursor']})
+        now = datetime.now()
+        session.add_all([PlayHistory(folder=folder, path=path, played_at=now) for path in played])
+        self._unpruned += len(played)
+        if self._unpruned >= PRUNE_EVERY:
+            self._prune(session)
+        session.commit()
+
+    def _prune(self, session):
+        """Delete all but the newest HISTORY_ROWS history rows."""
+        session.flush()
+        cutoff = (session.query(PlayHistory.id).order_by(PlayHistory.id.desc())
+                  .offset(HISTORY_ROWS).limit(1).scalar())
+        if cutoff is not None:
+            deleted = session.query(PlayHistory).filter(PlayHistory.id <= cutoff).delete(synchronize_session=False)
+            logger.info(f"Pruned {deleted} old play history rows")
+        self._unpruned = 0
+
+    def next(self, folder):
+        """Return the next track for a folder and record it as played, or None if the folder is empty."""
+        folder = os.path.normpath(folder)
+        with self._lock:
+            state = self._state(folder)
+
+            new_pass = False
+            path = None
+            for _ in range(2):  # At most one new pass per pick
+                while state['cursor'] < len(state['order']):
+                    candidate = state['order'][state['cursor']]
+                    state['cursor'] += 1
+                    if self.media_index.info(candidate) is not None:  # Skip files removed since the pass began
+                        path = candidate
+                        break
+                if path is not None:
+                    break
+                self._new_pass(folder, state)
+                new_pass = True
+            if path is None:
+                return None
+
+            with self.Session() as session:
+                self._store(session, folder, state, new_pass, [path])
+            if new_pass:
+                logger.info(f"Started rotation pass {state['pass_number']} over {len(state['order'])} tracks in {folder}")
+            return path
+
+    def whole_pass(self, folder):
+        """Return every track of a folder once and record them as played, e.g. for a looped playlist.
+
+        Tracks the current pass has not played yet come first, then tracks added since
+        it began, then those it already played. The current pass is finished, so the
+        next pick starts a new one. Returns an empty list if the folder is empty.
+        """
+        folder = os.path.normpath(folder)
+        with self._lock:
+            state = self._state(folder)
+            new_pass = state['cursor'] >= len(state['order'])
+            if new_pass:
+                self._new_pass(folder, state)
+            order = state['order']
+            known = set(order)
+            added = [path for path in self.media_index.files(folder, refresh=False) if path not in known]
+            tracks = [path for path in order[state['cursor']:] + added + order[:state['cursor']]
+                      if self.media_index.info(path) is not None]  # Skip files removed since the pass began
+            if not tracks:
+                return []
+            state['cursor'] = len(order)
+            with self.Session() as session:
+                self._store(session, folder, state, new_pass, tracks)
+            return tracks
+
+    def recent(self, limit=20, folder=None):
+        """Return the most recently played tracks, newest first."""
+        with self.Session() as session:
+            query = session.query(PlayHistory)
+            if folder:
+                query = query.filter(PlayHistory.folder == os.path.normpath(folder))
+            return [
+                {'folder': row.folder, 'path': row.path, 'played_at': row.played_at.isoformat()}
+                for row in query.order_by(PlayHistory.played_at.desc(), PlayHistory.id.desc()).limit(limit)
+            ]
@@ -0,0 +1,41 @@
+# schedule_cache.py
+import json
+import hashlib
+import threading
+
+
+class ScheduleCache:
+    """Cache of the schedule list shown on the dashboard, rebuilt only after a schedule changes."""
+
+    def __init__(self, loader):
+        self.loader = loader  # Callable returning the list of schedule dicts
+        self._schedules = None
+        self._etag = None
+        self._derived = {}  # name -> structure built from the cached schedules
+        self._lock = threading.Lock()
+
+    def get(self):
+        """Return the cached (schedules, etag), loading them on first use after an invalidation."""
+        with self._lock:
+            if self._schedules is None:
+                schedules = self.loader()
+                payload = json.dumps(schedules, sort_keys=True, default=str)
+                self._etag = hashlib.sha1(payload.encode('utf-8')).hexdigest()
+                self._schedules = schedules
+            return self._schedules, self._etag
+
+    def derived(self, name, builder):
+        """Return builder(schedules), built once per cached version of the schedule list."""
+        schedules, etag = self.get()
+        with self._lock:
+            cached = self._derived.get(name)
+            if cached is None or cached[0] != etag:
+                cached = self._derived[name] = (etag, builder(schedules))
+            return cached[1]
+
+    def invalidate(self):
+        """Drop the cached view so the next request reloads it from the database."""
+        with self._lock:
+            self._schedules = None
+            self._etag = None
+            self._derived = {}
@@ -0,0 +1,108 @@
+# schedule_conflicts.py
+import heapq
+from bisect import bisect_left
+from schedule_schema import DAY_NAMES, MINUTES_PER_DAY, minutes_to_time_str
+
+MINUTES_PER_WEEK = MINUTES_PER_DAY * len(DAY_NAMES)
+
+
+def week_segments(job):
+    """Return the [start, end) minute-of-week segments a schedule dict occupies.
+
+    A slot without an end time is treated as running until midnight, and a slot
+    whose end is not after its start runs into the next day (wrapping from
+    Sunday to Monday).
+    """
+    start_minute, end_minute, day_mask = job['start_minute'], job['end_minute'], job['day_mask'] or 0
+    if end_minute is None:
+        length = MINUTES_PER_DAY - start_minute
+    else:
+        length = (end_minute - start_minute) % MINUTES_PER_DAY or MINUTES_PER_DAY
+
+    segments = []
+    for day in range(len(DAY_NAMES)):
+        if day_mask & (1 << day):
+            start = day * MINUTES_PER_DAY + start_minute
+            end = start + length
+            if end > MINUTES_PER_WEEK:
+                segments.append((start, MINUTES_PER_WEEK))
+                segments.append((0, end - MINUTES_PER_WEEK))
+            else:
+                segments.append((start, end))
+    return segments
+
+
+def describe_segment(start, end):
+    """Human-readable 'Day HH:MM-HH:MM' for a minute-of-week segment."""
+    day, minute = divmod(start, MINUTES_PER_DAY)
+    return f"{DAY_NAMES[day]} {minutes_to_time_str(minute)}-{minutes_to_time_str((minute + end - start) % MINUTES_PER_DAY)}"
+
+
+class ScheduleConflictIndex:
+    """Interval index over the weekly timeline built from the schedule list.
+
+    Segments are sorted by start with a running maximum of their ends, so checking
+    a new slot for overlaps is a binary search plus a walk over the overlapping
+    segments only.
+    """
+
+    def __init__(self, schedules):
+        segments = sorted(
+            (start, end, job['id'])
+            for job in schedules
+            for start, end in week_segments(job)
+        )
+        self._starts = [segment[0] for segment in segments]
+        self._segments = segments
+        self._max_end = []
+        running = 0
+        for _, end, _ in segments:
+            running = max(running, end)
+            self._max_end.append(running)
+
+    def find_conflicts(self, job, exclude_id=None):
+        """Return the sorted IDs of schedules overlapping the given schedule dict."""
+        conflicts = set()
+        for start, end in week_segments(job):
+            # Only segments starting before this one ends can overlap it
+            index = bisect_left(self._starts, end) - 1
+            while index >= 0 and self._max_end[index] > start:
+                other_start, other_end, other_id = self._segments[index]
+                if other_end > start and other_id != exclude_id:
+                    conflicts.add(other_id)
+                index -= 1
+        return sorted(conflicts)
+
+    def all_conflicts(self):
+        """List every overlapping pair of schedules with a sweep over the sorted segments."""
+        active = []  # Heap of (end, start, schedule_id) for segments still open
+        overlaps = {}
+        for start, end, schedule_id in self._segments:
+            while active and active[0][0] <= start:
+                heapq.heappop(active)
+            for other_end, other_start, other_id in active:
+                if other_id == schedule_id:
+                    continue
+                pair = tuple(sorted((schedule_id, other_id)))
+                overlap = describe_segment(start, min(end, other_end))
+                overlaps.setdefault(pair, []).append(overlap)
+            heapq.heappush(active, (end, start, schedule_id))
+        return [{'schedule_ids': list(pair), 'overlaps': segments} for pair, segments in sorted(overlaps.items())]
+
+
+def find_batch_conflicts(index, jobs):
+    """Check a batch of new schedule dicts against the stored schedules' index and each other.
+
+    Returns (row number, message) for every row overlapping a stored schedule or an
+    earlier row of the batch, in the same form as schedule_io.validate_rows errors;
+    row numbers start at 1.
+    """
+    batch_index = ScheduleConflictIndex([{**job, 'id': number} for number, job in enumerate(jobs, start=1)])
+    conflicts = []
+    for number, job in enumerate(jobs, start=1):
+        stored = index.find_conflicts(job)
+        earlier = [other for other in batch_index.find_conflicts(job, exclude_id=number) if other < number]
+        overlaps = ([f"schedules {stored}"] if stored else []) + ([f"rows {earlier}"] if earlier else [])
+        if overlaps:
+            conflicts.append((number, f"Overlaps {' and '.join(overlaps)}"))
+    return conflicts
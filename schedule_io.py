@@ -0,0 +1,137 @@
+# schedule_io.py
+import csv
+import io
+import json
+from schedule_schema import (parse_time_to_minutes, minutes_to_time_str, days_to_mask, mask_to_days, DAY_NAMES,
+                             MISFIRE_POLICIES)
+
+FIELDS = ['play_music_folder', 'start_time', 'end_time', 'days', 'misfire_policy', 'power_devices']
+
+
+def validate_rows(rows):
+    """Validate schedule rows and return (normalized rows, errors).
+
+    Each row is a dict with play_music_folder, start_time, optional end_time,
+    days (a list of day names or a comma-separated string), optional
+    misfire_policy and optional power_devices. Errors are (row number, message) tuples; row numbers
+    start at 1.
+    """
+    valid, errors = [], []
+    for number, row in enumerate(rows, start=1):
+        if not isinstance(row, dict):
+            errors.append((number, "Row must be an object"))
+            continue
+        folder = row.get('play_music_folder') or ''
+        if not isinstance(folder, str):
+            errors.append((number, f"play_music_folder must be a string: {folder!r}"))
+            continue
+        folder = folder.strip()
+        if not folder:
+            errors.append((number, "Missing play_music_folder"))
+            continue
+        try:
+            start_minute = parse_time_to_minutes(row.get('start_time'))
+            end_minute = parse_time_to_minutes(row.get('end_time'))
+        except (ValueError, TypeError) as e:
+            errors.append((number, str(e)))
+            continue
+        if start_minute is None:
+            errors.append((number, "Missing start_time"))
+            continue
+
+        days = row.get('days') or []
+        if isinstance(days, str):
+            days = days.split(',')
+        if not isinstance(days, list) or not all(isinstance(day, str) for day in days):
+            errors.append((number, f"days must be day names: {days!r}"))
+            continue
+        unknown = [day for day in days if day.strip() not in DAY_NAMES]
+        day_mask = days_to_mask(days)
+        if unknown or not day_mask:
+            errors.append((number, f"Invalid days: {unknown or days}"))
+            continue
+
+        misfire_policy = row.get('misfire_policy') or None
+        if misfire_policy not in (None,) + MISFIRE_POLICIES:
+            errors.append((number, f"Invalid misfire_policy: {misfire_policy}"))
+            continue
+
+        power_devices = row.get('power_devices')
+        members = power_devices if isinstance(power_devices, (list, tuple)) else [power_devices]
+        if not all(member is None or (isinstance(member, (str, int)) and not isinstance(member, bool))
+                   for member in members):
+            errors.append((number, f"power_devices must be a group name or device indexes/names: {power_devices!r}"))
+            continue
+
+        valid.append({
+            'play_music_folder': folder,
+            'start_time': minutes_to_time_str(start_minute),
+            'end_time': minutes_to_time_str(end_minute),
+            'days': mask_to_days(day_mask),
+            'misfire_policy': misfire_policy,
+            'power_devices': normalize_power_devices(power_devices),
+        })
+    return valid, errors
+
+
+def normalize_power_devices(value):
+    """Clean a power_devices value: a group name or comma-separated device indexes/names, None if empty."""
+    if isinstance(value, (list, tuple)):
+        value = ','.join(str(member) for member in value if member is not None)
+    elif isinstance(value, int):
+        value = str(value)
+    members = [member.strip() for member in (value or '').split(',') if member.strip()]
+    return ','.join(members) or None
+
+
+def parse_json(text):
+    """Parse a JSON list of schedules, or an object with a 'schedules' list."""
+    data = json.loads(text)
+    if isinstance(data, dict):
+        data = data.get('schedules', [])
+    if not isinstance(data, list):
+        raise ValueError("Expected a list of schedules")
+    return data
+
+
+def parse_csv(text):
+    """Parse CSV with a header row of play_music_folder,start_time,end_time,days."""
+    return [dict(row) for row in csv.DictReader(io.StringIO(text))]
+
+
+def export_rows(schedules):
+    """Import-format rows for the schedules, skipping any without days since an import would reject them."""
+    rows = [export_row(schedule) for schedule in schedules]
+    return [row for row in rows if row['days']]
+
+
+def to_json(schedules):
+    """Serialize schedule dicts in the import format."""
+    return json.dumps({'schedules': export_rows(schedules)}, indent=2)
+
+
+def to_csv(schedules):
+    """Serialize schedule dicts as CSV in the import format."""
+    output = io.StringIO()
+    writer = csv.DictWriter(output, fieldnames=FIELDS, lineterminator='\n')
+    writer.writeheader()
+    for row in export_rows(schedules):
+        row['days'] = ','.join(row['days'])
+        row['end_time'] = row['end_time'] or ''
+        row['misfire_policy'] = row['misfire_policy'] or ''
+        row['power_devices'] = row['power_devices'] or ''
+        writer.writerow(row)
+    return output.getvalue()
+
+
+def export_row(schedule):
+    """Keep only the importable fields of a schedule dict."""
+    days = schedule['days']
+    return {
+        'play_music_folder': schedule['play_music_folder'],
+        'start_time': schedule['start_time'],
+        'end_time': schedule['end_time'],
+        'days': [day for day in days.split(',') if day] if isinstance(days, str) else list(days),
+        'misfire_policy': schedule.get('misfire_policy'),
+        'power_devices': schedule.get('power_devices'),
+    }
@@ -0,0 +1,114 @@
+# schedule_schema.py
+import logging
+from datetime import time as dt_time
+from sqlalchemy import text
+
+logger = logging.getLogger(__name__)
+
+DAY_NAMES = ["Monday", "Tuesday", "Wednesday", "Thursday", "Friday", "Saturday", "Sunday"]
+ALL_DAYS_MASK = (1 << len(DAY_NAMES)) - 1
+MINUTES_PER_DAY = 24 * 60
+
+# Columns added on top of the original string schema: (name, SQL type)
+NORMALIZED_COLUMNS = [
+    ('start_minute', 'INTEGER'),  # Minutes after midnight
+    ('end_minute', 'INTEGER'),  # Minutes after midnight, NULL if no end time
+    ('day_mask', 'INTEGER'),  # Bit 0 = Monday ... bit 6 = Sunday
+    ('misfire_policy', 'VARCHAR(10)'),  # How triggers missed while down are caught up, NULL = 'grace'
+    ('power_devices', 'VARCHAR(200)'),  # Device group or comma-separated devices powered for the slot, NULL = none
+]
+DAY_START_INDEX = 'ix_schedule_day_mask_start_minute'
+
+# Per-schedule handling of start triggers missed while the app was down:
+#   skip  - never start late
+#   grace - start if no more than the scheduler's misfire grace late (default)
+#   slot  - start late at any point before the slot's end time
+MISFIRE_POLICIES = ('skip', 'grace', 'slot')
+
+
+def parse_time_to_minutes(value):
+    """Convert 'HH:MM', 'HH:MM:SS[.ffffff]' or a time object to minutes after midnight."""
+    if value is None or value == '':
+        return None
+    if isinstance(value, dt_time):
+        return value.hour * 60 + value.minute
+    parts = str(value).strip().split(':')
+    if len(parts) < 2:
+        raise ValueError(f"Invalid time: {value!r}")
+    hours, minutes = int(parts[0]), int(parts[1])
+    if not (0 <= hours < 24 and 0 <= minutes < 60):
+        raise ValueError(f"Invalid time: {value!r}")
+    return hours * 60 + minutes
+
+
+def minutes_to_time_str(minutes):
+    """Format minutes after midnight as 'HH:MM'."""
+    if minutes is None:
+        return None
+    return f"{minutes // 60:02d}:{minutes % 60:02d}"
+
+
+def days_to_mask(days):
+    """Convert day names (list or comma-separated string) to a weekday bitmask."""
+    if isinstance(days, str):
+        days = days.split(',')
+    mask = 0
+    for day in days:
+        day = day.strip()
+        if day in DAY_NAMES:
+            mask |= 1 << DAY_NAMES.index(day)
+    return mask
+
+
+def mask_to_days(mask):
+    """Convert a weekday bitmask back to the list of day names."""
+    return [day for index, day in enumerate(DAY_NAMES) if mask and mask & (1 << index)]
+
+
+def weekday_bit(weekday):
+    """Bit for a datetime.weekday() value."""
+    return 1 << weekday
+
+
+def masks_with_day(bit):
+    """Every day mask that includes the given day bit.
+
+    Filtering with day_mask IN (...) instead of day_mask & bit lets SQLite search
+    the (day_mask, start_minute) index rather than scan the table.
+    """
+    return [mask for mask in range(1, ALL_DAYS_MASK + 1) if mask & bit]
+
+
+def migrate_schedule_table(engine):
+    """Add and backfill the normalized columns and index on an existing schedule table."""
+    with engine.begin() as conn:
+        existing = {row[1] for row in conn.execute(text("PRAGMA table_info(schedule)"))}
+        if not existing:
+            return
+        for name, sql_type in NORMALIZED_COLUMNS:
+            if name not in existing:
+                conn.execute(text(f"ALTER TABLE schedule ADD COLUMN {name} {sql_type}"))
+                logger.info(f"Added column schedule.{name}")
+
+        rows = conn.execute(text(
+            "SELECT id, start_time, end_time, days FROM schedule "
+            "WHERE start_minute IS NULL OR day_mask IS NULL"
+        )).fetchall()
+        for row in rows:
+            try:
+                start_minute = parse_time_to_minutes(row.start_time)
+                end_minute = parse_time_to_minutes(row.end_time)
+            except ValueError as e:
+                logger.error(f"Cannot migrate schedule {row.id}: {e}")
+                continue
+            conn.execute(
+                text("UPDATE schedule SET start_minute = :start, end_minute = :end, day_mask = :mask, "
+                     "start_time = :start_time, end_time = :end_time WHERE id = :id"),
+                {'start': start_minute, 'end': end_minute, 'mask': days_to_mask(row.days or ''),
+                 'start_time': minutes_to_time_str(start_minute), 'end_time': minutes_to_time_str(end_minute),
+                 'id': row.id}
+            )
+        if rows:
+            logger.info(f"Migrated {len(rows)} schedules to the normalized schema")
+
+        conn.execute(text(f"CREATE INDEX IF NOT EXISTS {DAY_START_INDEX} ON schedule (day_mask, start_minute)"))
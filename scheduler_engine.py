@@ -0,0 +1,203 @@
+# scheduler_engine.py
+import logging
+import threading
+from collections import deque
+from datetime import datetime, timedelta
+from apscheduler.events import EVENT_JOB_SUBMITTED, EVENT_JOB_MISSED
+from apscheduler.triggers.cron import CronTrigger
+from apscheduler.util import obj_to_ref, undefined
+from schedule_schema import DAY_NAMES, MINUTES_PER_DAY
+from metrics import SCHEDULER_LATENESS_SECONDS, SCHEDULER_MISSED_TOTAL, PLAYBACK_OFFSET_SECONDS, job_kind
+
+logger = logging.getLogger(__name__)
+
+# How late a trigger may still run, e.g. when the process is busy or the machine was asleep
+MISFIRE_GRACE_SECONDS = 120
+# Stop jobs fire this much ahead of their fade-out so trigger lateness does not delay the final stop
+STOP_LEAD_SECONDS = 2
+
+APSCHEDULER_DAYS = ['mon', 'tue', 'wed', 'thu', 'fri', 'sat', 'sun']
+
+def misfire_grace_for(job):
+    """Return the start job's misfire_grace_time in seconds for a schedule dict's policy."""
+    policy = job.get('misfire_policy') or 'grace'
+    if policy == 'skip':
+        return 1
+    if policy == 'slot' and job['end_minute'] is not None:
+        return ((job['end_minute'] - job['start_minute']) % MINUTES_PER_DAY) * 60 or MISFIRE_GRACE_SECONDS
+    return MISFIRE_GRACE_SECONDS
+
+
+def mask_to_day_of_week(day_mask):
+    """Convert a weekday bitmask to an APScheduler day_of_week expression."""
+    days = [APSCHEDULER_DAYS[index] for index in range(len(DAY_NAMES)) if day_mask & (1 << index)]
+    return ','.join(days) if days else None
+
+
+def minute_trigger(minute_of_day, day_mask, second=0):
+    """Cron trigger firing at minute_of_day (plus second) on every day in the mask."""
+    day_of_week = mask_to_day_of_week(day_mask)
+    if day_of_week is None:
+        return None
+    hour, minute = divmod(minute_of_day, 60)
+    return CronTrigger(day_of_week=day_of_week, hour=hour, minute=minute, second=second)
+
+
+def offset_trigger(minute_of_day, day_mask, offset_seconds):
+    """Cron trigger firing offset_seconds before (negative) or after a minute of day, moving days if needed."""
+    seconds = minute_of_day * 60 + offset_seconds
+    day_shift, seconds = divmod(seconds, MINUTES_PER_DAY * 60)
+    minute, second = divmod(seconds, 60)
+    return minute_trigger(minute, shift_mask(day_mask, day_shift), second=second)
+
+
+def next_occurrence(minute_of_day, now=None):
+    """datetime of the next time the clock reads minute_of_day, strictly after now."""
+    now = now or datetime.now()
+    when = now.replace(hour=minute_of_day // 60, minute=minute_of_day % 60, second=0, microsecond=0)
+    return when if when > now else when + timedelta(days=1)
+
+
+def nearest_occurrence(minute_of_day, now=None):
+    """datetime of minute_of_day closest to now, before or after it (for jobs that run a little early or late)."""
+    now = now or datetime.now()
+    when = next_occurrence(minute_of_day, now)
+    previous = when - timedelta(days=1)
+    return previous if now - previous < when - now else when
+
+
+def shift_mask(day_mask, days=1):
+    """Rotate a weekday bitmask forward, e.g. for a slot that ends after midnight."""
+    count = len(DAY_NAMES)
+    days %= count
+    return ((day_mask << days) | (day_mask >> (count - days))) & ((1 << count) - 1)
+
+
+class JobReconciler:
+    """Bring the scheduler's jobs in line with a desired set keyed on deterministic job ids.
+
+    Only jobs whose id starts with prefix are managed; anything else in the
+    scheduler is left alone. Jobs are added, replaced or removed only when they
+    differ from the desired spec, so reconciling an unchanged schedule is free.
+    """
+
+    def __init__(self, scheduler, prefix='schedule_'):
+        self.scheduler = scheduler
+        self.prefix = prefix
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _matches(job, spec):
+        return (job.func_ref == obj_to_ref(spec['func'])
+                and str(job.trigger) == str(spec['trigger'])
+                and list(job.args) == list(spec.get('args', []))
+                and ('misfire_grace_time' not in spec or job.misfire_grace_time == spec['misfire_grace_time']))
+
+    def reconcile(self, desired):
+        """Apply the desired {job_id: {'func', 'trigger', 'args', 'misfire_grace_time'}} mapping.
+
+        Returns (added, changed, removed).
+        """
+        with self._lock:
+            existing = {job.id: job for job in self.scheduler.get_jobs() if job.id.startswith(self.prefix)}
+            added = changed = 0
+            for job_id, spec in desired.items():
+                job = existing.pop(job_id, None)
+                if job is not None and self._matches(job, spec):
+                    continue
+                self.scheduler.add_job(spec['func'], spec['trigger'], args=spec.get('args', []),
+                                       misfire_grace_time=spec.get('misfire_grace_time', undefined),
+                                       id=job_id, replace_existing=True)
+                if job is None:
+                    added += 1
+                else:
+                    changed += 1
+            for job_id in existing:
+                self.scheduler.remove_job(job_id)
+
+            if added or changed or existing:
+                logger.info(f"Reconciled scheduler jobs: {added} added, {changed} changed, {len(existing)} removed")
+            return added, changed, len(existing)
+
+
+class TriggerRecorder:
+    """Record scheduled fire time, dispatch time and lateness for every job trigger."""
+
+    def __init__(self, max_records=500):
+        self.records = deque(maxlen=max_records)
+        self.starts = deque(maxlen=max_records)
+        self.stops = deque(maxlen=max_records)
+        self._lock = threading.Lock()
+
+    def attach(self, scheduler):
+        """Listen for submitted and missed jobs on an APScheduler scheduler."""
+        scheduler.add_listener(self._on_event, EVENT_JOB_SUBMITTED | EVENT_JOB_MISSED)
+
+    def _on_event(self, event):
+        missed = event.code == EVENT_JOB_MISSED
+        run_times = [event.scheduled_run_time] if missed else event.scheduled_run_times
+        for scheduled in run_times:
+            dispatched = datetime.now(scheduled.tzinfo)
+            lateness = (dispatched - scheduled).total_seconds()
+            record = {
+                'job_id': event.job_id,
+                'scheduled': scheduled.isoformat(),
+                'dispatched': dispatched.isoformat(),
+                'lateness_seconds': round(lateness, 3),
+                'missed': missed,
+            }
+            with self._lock:
+                self.records.append(record)
+            if missed:
+                SCHEDULER_MISSED_TOTAL.inc(job_kind(event.job_id))
+                logger.warning(f"Job {event.job_id} missed its {scheduled} trigger by {lateness:.1f}s")
+            else:
+                SCHEDULER_LATENESS_SECONDS.observe(lateness, job_kind(event.job_id))
+                logger.info(f"Job {event.job_id} dispatched {lateness:.3f}s after {scheduled}")
+
+    def _record_playback(self, records, event, job_id, scheduled, result):
+        """Append how far a playback event landed from its scheduled instant.
+
+        If result is a future (from the threaded VLC controller) the event is
+        measured when VLC acknowledges the command.
+        """
+        def record(_=None):
+            happened = datetime.now()
+            offset = (happened - scheduled).total_seconds()
+            PLAYBACK_OFFSET_SECONDS.observe(offset, event)
+            with self._lock:
+                records.append({
+                    'job_id': job_id,
+                    'scheduled': scheduled.isoformat(),
+                    event: happened.isoformat(),
+                    'jitter_seconds': round(offset, 3),
+                })
+            logger.info(f"Playback for {job_id} {event} {offset:.3f}s after {scheduled}")
+
+        if hasattr(result, 'add_done_callback'):
+            result.add_done_callback(record)
+        else:
+            record()
+
+    def record_start(self, job_id, scheduled_start, result=None):
+        """Record how far playback started from its scheduled instant."""
+        self._record_playback(self.starts, 'started', job_id, scheduled_start, result)
+
+    def record_stop(self, job_id, scheduled_end, result=None):
+        """Record how far the final stop landed from the slot's end time."""
+        self._record_playback(self.stops, 'stopped', job_id, scheduled_end, result)
+
+    def recent_starts(self, limit=50):
+        """Return the most recent playback start jitter records, newest first."""
+        with self._lock:
+            return list(self.starts)[-limit:][::-1]
+
+    def recent_stops(self, limit=50):
+        """Return the most recent stop error records, newest first."""
+        with self._lock:
+            return list(self.stops)[-limit:][::-1]
+
+    def recent(self, limit=50):
+        """Return the most recent trigger records, newest first."""
+        with self._lock:
+            return list(self.records)[-limit:][::-1]
@@ -0,0 +1,569 @@
+# vlc_controller.py
+import re
+import socket
+import subprocess
+import logging
+import threading
+import queue
+import time
+from concurrent.futures import Future
+from rc_client import RCClient
+from metrics import VLC_STARTUP_SECONDS
+from log_config import summarize
+
+logger = logging.getLogger(__name__)
+
+VLC_PATH = r"C:\Program Files\VideoLAN\VLC\vlc.exe"
+
+# VLC's RC 'volume' scale: 256 is 100%, up to 512
+RC_VOLUME_100 = 256
+
+# Parts of the RC 'status' reply, e.g. "( audio volume: 256 )" and "( state playing )"
+STATE_PATTERN = re.compile(r'\( state (\w+) \)')
+VOLUME_PATTERN = re.compile(r'\( audio volume: (\d+) \)')
+
+
+class VLCController:
+    def __init__(self, host='127.0.0.1', port=44500, startup_timeout=15.0):
+        self.host = host
+        self.port = port
+        self.rc = None  # RCClient once connected
+        self.vlc_process = None
+        self.is_playing = False  # Track playback status
+        self.startup_timeout = startup_timeout  # Seconds to wait for the RC interface
+        self.startup_latency = None  # Measured seconds from spawn to RC ready
+        self.playlist = []  # Media added since the last clear, used to restore after a crash
+        self.volume = None  # Last volume set through set_volume, in RC units
+        self.random = None  # Last 'random' and 'loop' modes set, None if never set
+        self.loop = None
+        self._start_lock = threading.RLock()  # One thread at a time may spawn VLC or connect to it
+        self.owner = None  # Who started the current playback, e.g. a schedule ID; None if unknown
+        self._owner_lock = threading.Lock()
+        self._fade_level = None  # Volume a running fade-out started from
+
+    def is_vlc_running(self):
+        """Check if VLC is already running."""
+        return self.vlc_process is not None and self.vlc_process.poll() is None
+
+    def start_vlc(self, media_path=None):
+        """Start VLC with the given media path if provided.
+
+        Safe to call from several threads: callers that find VLC already started by
+        another thread return without spawning a second process on the same RC port.
+        Returns True if this call started VLC.
+        """
+        with self._start_lock:
+            if self.is_vlc_running():
+                logger.warning("VLC is already running.")
+                return False
+            self._drop_connection()  # Any connection left belongs to a dead process
+
+            vlc_command = [
+                VLC_PATH,
+                "--intf", "rc",
+                "--rc-host", f"{self.host}:{self.port}",
+                "--verbose", "2"  # Increase verbosity for debugging
+            ]
+            if media_path:
+                vlc_command.append(media_path)
+
+            logger.info(f"Starting VLC with command: {vlc_command}")
+            started = time.monotonic()
+            self.vlc_process = subprocess.Popen(vlc_command)
+            logger.info("VLC started with RC interface.")
+
+            if self.wait_until_ready(self.startup_timeout):
+                self.startup_latency = time.monotonic() - started
+                VLC_STARTUP_SECONDS.observe(self.startup_latency)
+                logger.info(f"VLC RC interface ready after {self.startup_latency:.3f}s")
+            else:
+                logger.error(f"VLC RC interface not ready after {self.startup_timeout}s")
+            return True
+
+    def wait_until_ready(self, timeout):
+        """Poll the RC port with backoff until VLC answers with its banner or the deadline passes."""
+        deadline = time.monotonic() + timeout
+        delay = 0.05
+        while time.monotonic() < deadline:
+            if self.vlc_process is not None and self.vlc_process.poll() is not None:
+                logger.error(f"VLC exited during startup with code {self.vlc_process.returncode}")
+                return False
+            try:
+                sock = socket.create_connection((self.host, self.port),
+                                                timeout=max(deadline - time.monotonic(), 0.01))
+            except OSError:
+                time.sleep(min(delay, max(deadline - time.monotonic(), 0)))
+                delay = min(delay * 2, 0.5)
+                continue
+
+            rc = RCClient(sock)
+            try:
+                banner = rc.read_reply(timeout=max(deadline - time.monotonic(), 0.01))
+            except (OSError, ConnectionError):
+                rc.close()
+                continue
+            self.rc = rc
+            logger.info(f"Connected to VLC on {self.host}:{self.port}")
+            logger.debug(f"VLC banner: {banner}")
+            return True
+        return False
+
+    def connect(self):
+        """Establish a connection to the VLC RC interface unless another thread already has."""
+        with self._start_lock:
+            if self.rc is not None:
+                return
+            if not self.wait_until_ready(self.startup_timeout):
+                logger.error(f"Error connecting to VLC on {self.host}:{self.port}")
+
+    def send_command(self, command):
+        """Send a command to VLC and return its reply."""
+        replies = self.send_commands([command])
+        return replies[0] if replies else None
+
+    def send_commands(self, commands):
+        """Pipeline several commands to VLC in one write and return the replies in order."""
+        if self.rc:
+            try:
+                replies = self.rc.send_many(commands)
+                # One summarized line per batch; a pipelined enqueue can carry hundreds of paths
+                if logger.isEnabledFor(logging.DEBUG):
+                    logger.debug(f"Sent {summarize(commands)}")
+                    answered = [reply for reply in replies if reply]
+                    if answered:
+                        logger.debug(f"VLC replied: {summarize(answered)}")
+                return replies
+            except (socket.error, ConnectionError) as e:
+                logger.error(f"Socket error when sending command: {e}")
+                self._drop_connection()
+            except Exception as e:
+                logger.error(f"Error sending command: {e}")
+        return []
+
+    def _drop_connection(self):
+        """Forget a broken RC connection so the supervisor can reconnect."""
+        rc, self.rc = self.rc, None
+        if rc:
+            rc.close()
+
+    def close(self):
+        """Close the connection to VLC and terminate the VLC process."""
+        if self.rc:
+            self.rc.close()
+            self.rc = None
+            logger.info("Connection to VLC closed.")
+        if self.vlc_process:
+            self.vlc_process.terminate()
+            self.vlc_process = None
+            logger.info("VLC process terminated.")
+
+    def play(self):
+        """Play the currently loaded media."""
+        if not self.is_playing:
+            self.is_playing = True  # Set playing status
+            return self.send_command("play")
+
+    def claim(self, owner):
+        """Record owner as the one starting playback, before it sends 'play'.
+
+        A fade-out still running for the previous owner is abandoned: its volume is
+        put back right away and it will not send its 'stop'.
+        """
+        with self._owner_lock:
+            self.owner = owner
+            if self._fade_level is not None:
+                self.send_command(f"volume {self._fade_level}")
+                self._fade_level = None
+
+    def stop(self):
+        """Stop the music playback only if it's currently playing."""
+        self.owner = None
+        if self.is_playing:
+            self.send_command("stop")
+            logger.info("Music playback stopped.")
+            self.is_playing = False
+        else:
+            logger.info("No music is currently playing to stop.")
+
+    def current_volume(self):
+        """Ask VLC for its volume on its own 0-512 scale (256 is 100%), or None if it does not answer."""
+        reply = self.send_command("volume")
+        if isinstance(reply, Future):
+            try:
+                reply = reply.result(timeout=5)
+            except Exception:
+                reply = None
+        # Only a bare number is the volume; other lines are notices such as "( play state: 3 )"
+        for line in (reply or '').splitlines():
+            if line.strip().isdigit():
+                return int(line.strip())
+        return None
+
+    def fade_out(self, seconds, stop_at=None, steps=10, owner=None):
+        """Ramp the volume down to zero, stop at stop_at, then put the volume back.
+
+        The ramp starts from the volume VLC reports and takes the last `seconds`
+        before stop_at, a time.monotonic() deadline that defaults to now + seconds.
+        That same volume is restored after the stop. If VLC does not report its
+        volume it stops without fading. With an owner, nothing happens unless it
+        owns playback, and the fade is abandoned as soon as another owner claims it.
+        Returns the 'stop' command's result, or None if nothing was stopped.
+        """
+        if not self.is_playing or (owner is not None and self.owner != owner):
+            logger.info("No music is currently playing to stop.")
+            return None
+        stop_at = stop_at if stop_at is not None else time.monotonic() + seconds
+        level = self.current_volume()
+        if level is None:
+            logger.warning("Could not read the VLC volume, stopping without a fade.")
+            seconds, steps = 0, 1
+        with self._owner_lock:
+            self._fade_level = level
+        step_seconds = seconds / steps
+        for step in range(1, steps if seconds > 0 else 1):
+            delay = stop_at - (steps - step) * step_seconds - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            with self._owner_lock:
+                if owner is not None and self.owner != owner:
+                    logger.info("Playback was taken over, fade-out abandoned.")
+                    return None
+                self.send_command(f"volume {level * (steps - step) // steps}")
+        delay = stop_at - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+
+        # Checked and sent under the lock, so a claim lands either before this stop or after it
+        with self._owner_lock:
+            if owner is not None and self.owner != owner:
+                logger.info("Playback was taken over, fade-out abandoned.")
+                return None
+            result = self.send_command("stop")
+            self.is_playing = False
+            self.owner = None
+            if level is not None:
+                self.send_command(f"volume {level}")  # Ready for the next slot at the level it had
+            self._fade_level = None
+        logger.info(f"Music faded out over {seconds:.0f}s and stopped.")
+        return result
+
+    def add_to_playlist(self, media_path):
+        """Add media to the VLC playlist."""
+        self.playlist.append(media_path)
+        return self.send_command(f"add {media_path}")
+
+    def enqueue_many(self, media_paths):
+        """Queue several media files with a single pipelined write."""
+        self.playlist.extend(media_paths)
+        return self.send_commands([f"enqueue {path}" for path in media_paths])
+
+    def clear_playlist(self):
+        """Remove every item from the VLC playlist."""
+        self.playlist = []
+        self.is_playing = False  # Clearing the playlist stops playback
+        return self.send_command("clear")
+
+    def set_random(self, enabled):
+        """Turn VLC's random jumping through the playlist on or off."""
+        self.random = enabled
+        return self.send_command(f"random {'on' if enabled else 'off'}")
+
+    def set_loop(self, enabled):
+        """Turn looping of the whole playlist on or off."""
+        self.loop = enabled
+        return self.send_command(f"loop {'on' if enabled else 'off'}")
+
+    def set_volume(self, volume):
+        """Set the volume in percent (0-100), converted to VLC's RC scale where 256 is 100%."""
+        if 0 <= volume <= 100:
+            self.volume = volume * RC_VOLUME_100 // 100
+            self.send_command(f"volume {self.volume}")
+        else:
+            logger.error("Volume must be between 0 and 100.")
+
+
+class ThreadedVLCController(VLCController):
+    """VLCController whose socket is owned by a dedicated I/O thread.
+
+    Commands from any thread are queued and written in order by the worker, so
+    callers never interleave bytes on the wire. send_command and send_commands
+    return futures instead of blocking on VLC's reply.
+    """
+
+    def __init__(self, host='127.0.0.1', port=44500, startup_timeout=15.0):
+        super().__init__(host, port, startup_timeout)
+        self._commands = queue.Queue()
+        self._worker = threading.Thread(target=self._run, name="vlc-io", daemon=True)
+        self._worker.start()
+
+    def _run(self):
+        """Drain the command queue, pipelining everything pending into one write."""
+        while True:
+            batch = [self._commands.get()]
+            while True:
+                try:
+                    batch.append(self._commands.get_nowait())
+                except queue.Empty:
+                    break
+
+            stopping = None in batch
+            batch = [item for item in batch if item is not None]
+            commands = [command for item in batch for command in item[0]]
+            replies = VLCController.send_commands(self, commands) if commands else []
+            replies += [None] * (len(commands) - len(replies))
+
+            offset = 0
+            for item_commands, future, single in batch:
+                item_replies = replies[offset:offset + len(item_commands)]
+                offset += len(item_commands)
+                future.set_result(item_replies[0] if single else item_replies)
+
+            if stopping:
+                return
+
+    def _submit(self, commands, single):
+        future = Future()
+        if not self._worker.is_alive():
+            future.set_result(None if single else [])
+            return future
+        self._commands.put((list(commands), future, single))
+        return future
+
+    def send_command(self, command):
+        """Queue a command and return a future resolving to its reply."""
+        return self._submit([command], single=True)
+
+    def send_commands(self, commands):
+        """Queue several commands and return a future resolving to their replies."""
+        return self._submit(commands, single=False)
+
+    def close(self):
+        """Flush queued commands, stop the I/O thread and close VLC."""
+        if self._worker.is_alive():
+            self._commands.put(None)
+            self._worker.join(timeout=5)
+        super().close()
+
+
+class VLCSupervisor:
+    """Watch the VLC process and RC socket and restore playback after a failure."""
+
+    def __init__(self, vlc, interval=1.0, max_backoff=30.0):
+        self.vlc = vlc
+        self.interval = interval  # Seconds between health checks
+        self.max_backoff = max_backoff
+        self.restart_count = 0
+        self.failure_count = 0
+        self.total_downtime = 0.0
+        self.last_downtime = None
+        self.down_since = None
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    def start(self):
+        """Start the supervision thread."""
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, name="vlc-supervisor", daemon=True)
+        self._thread.start()
+        logger.info("VLC supervisor started.")
+
+    def stop(self):
+        """Stop the supervision thread."""
+        self._stop_event.set()
+        if self._thread:
+            self._thread.join(timeout=5)
+
+    def is_healthy(self):
+        """Return True if the VLC process is alive and the RC socket is connected."""
+        return self.vlc.is_vlc_running() and self.vlc.rc is not None
+
+    def _run(self):
+        while not self._stop_event.wait(self.interval):
+            if not self.is_healthy():
+                self._recover()
+
+    def _recover(self):
+        """Restart VLC and reconnect with backoff, then restore the previous state."""
+        self.failure_count += 1
+        self.down_since = time.monotonic()
+        state = {
+            'playlist': list(self.vlc.playlist),
+            'volume': self.vlc.volume,
+            'random': self.vlc.random,
+            'loop': self.vlc.loop,
+            'was_playing': self.vlc.is_playing,
+        }
+        self.vlc.is_playing = False
+        logger.error(f"VLC failure detected (process running: {self.vlc.is_vlc_running()}, "
+                      f"connected: {self.vlc.rc is not None}); recovering.")
+
+        backoff = 1.0
+        while not self._stop_event.is_set():
+            if self.vlc.is_vlc_running():
+                self.vlc.connect()
+            else:
+                try:
+                    if self.vlc.start_vlc():  # False if a scheduler job restarted it first
+                        self.restart_count += 1
+                except OSError as e:
+                    logger.error(f"Error restarting VLC: {e}")
+            if self.is_healthy():
+                break
+            logger.warning(f"VLC recovery failed, retrying in {backoff:.0f}s")
+            self._stop_event.wait(backoff)
+            backoff = min(backoff * 2, self.max_backoff)
+
+        if not self.is_healthy():
+            return
+        self._restore(state)
+        self.last_downtime = time.monotonic() - self.down_since
+        self.total_downtime += self.last_downtime
+        self.down_since = None
+        logger.info(f"VLC recovered after {self.last_downtime:.1f}s")
+
+    def _restore(self, state):
+        """Replay the playlist, volume, playlist modes and playback state captured before the failure."""
+        commands = [f"enqueue {path}" for path in state['playlist']]
+        if state['volume'] is not None:
+            commands.append(f"volume {state['volume']}")
+        for mode in ('random', 'loop'):
+            if state[mode] is not None:
+                commands.append(f"{mode} {'on' if state[mode] else 'off'}")
+        if state['was_playing']:
+            commands.append("play")
+        if commands:
+            self.vlc.send_commands(commands)
+        self.vlc.is_playing = state['was_playing']
+        logger.info(f"Restored {len(state['playlist'])} playlist items after VLC recovery.")
+
+    def metrics(self):
+        """Return restart and downtime counters."""
+        current = time.monotonic() - self.down_since if self.down_since else 0.0
+        return {
+            'healthy': self.is_healthy(),
+            'restart_count': self.restart_count,
+            'failure_count': self.failure_count,
+            'total_downtime_seconds': round(self.total_downtime + current, 3),
+            'last_downtime_seconds': round(self.last_downtime, 3) if self.last_downtime is not None else None,
+            'startup_latency_seconds': self.vlc.startup_latency,
+        }
+
+
+class PlaybackTracker:
+    """Poll VLC's playback state and publish it as a cached now-playing view.
+
+    Each poll pipelines 'status', 'get_title', 'get_time' and 'get_length' in one
+    write. Polls run every fast_interval seconds near the end of a track,
+    every playing_interval seconds otherwise while playing, and every
+    idle_interval seconds when nothing plays. The controller's is_playing flag is
+    set from what VLC reports, so it follows tracks ending or VLC being controlled
+    by hand.
+
+    The state's track_starts counts the tracks VLC has started since the tracker
+    began: playback starting, the title changing, or the position jumping back.
+    """
+
+    POLL_COMMANDS = ['status', 'get_title', 'get_time', 'get_length']
+    ACTIVE_STATES = ('playing', 'paused')
+
+    def __init__(self, vlc, idle_interval=5.0, playing_interval=2.0, fast_interval=0.5, near_end=5.0):
+        self.vlc = vlc
+        self.idle_interval = idle_interval
+        self.playing_interval = playing_interval
+        self.fast_interval = fast_interval
+        self.near_end = near_end  # Seconds before a track's end at which polling speeds up
+        self._state = {'state': 'disconnected', 'title': None, 'time': None, 'length': None,
+                       'remaining': None, 'volume': None, 'updated': None, 'track_starts': 0}
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    def start(self):
+        """Start the polling thread."""
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, name="vlc-tracker", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Stop the polling thread."""
+        self._stop_event.set()
+        self._wakeup.set()
+        if self._thread:
+            self._thread.join(timeout=5)
+
+    def refresh(self):
+        """Poll again right away, e.g. after a command changed playback."""
+        self._wakeup.set()
+
+    def now_playing(self):
+        """Return the cached playback state without touching VLC."""
+        with self._lock:
+            return dict(self._state)
+
+    @staticmethod
+    def _seconds(reply):
+        reply = (reply or '').strip()
+        return int(reply) if reply.isdigit() else None
+
+    def poll(self):
+        """Query VLC once, update the cache and return the new state."""
+        replies = self.vlc.send_commands(self.POLL_COMMANDS) if self.vlc.rc else []
+        if isinstance(replies, Future):
+            try:
+                replies = replies.result(timeout=5)
+            except Exception:
+                replies = []
+        # The I/O thread pads the replies of a failed batch with None
+        if len(replies) != len(self.POLL_COMMANDS) or any(reply is None for reply in replies):
+            state = {'state': 'disconnected', 'title': None, 'time': None, 'length': None, 'volume': None}
+        else:
+            status, title, position, length = replies
+            match = STATE_PATTERN.search(status)
+            volume = VOLUME_PATTERN.search(status)
+            state = {
+                'state': match.group(1) if match else 'stopped',
+                'title': title.strip() or None,
+                'time': self._seconds(position),
+                'length': self._seconds(length),
+                'volume': int(volume.group(1)) if volume else None,
+            }
+        playing = state['state'] == 'playing'
+        state['remaining'] = (state['length'] - state['time']
+                              if playing and state['length'] and state['time'] is not None else None)
+        state['updated'] = time.time()
+
+        with self._lock:
+            previous = self._state
+            started = state['state'] in self.ACTIVE_STATES and (
+                previous['state'] not in self.ACTIVE_STATES or state['title'] != previous['title']
+                or (state['time'] is not None and previous['time'] is not None and state['time'] < previous['time']))
+            state['track_starts'] = previous['track_starts'] + started
+            self._state = state
+        if state['state'] != 'disconnected':  # The supervisor restores playback across reconnects
+            self.vlc.is_playing = playing
+        if state['title'] != previous['title'] or state['state'] != previous['state']:
+            logger.info(f"VLC {state['state']}: {state['title'] or '-'}")
+        return state
+
+    def _interval(self, state):
+        if state['state'] != 'playing':
+            return self.idle_interval
+        remaining = state['remaining']
+        if remaining is not None and remaining <= self.near_end + self.playing_interval:
+            return self.fast_interval
+        return self.playing_interval
+
+    def _run(self):
+        while not self._stop_event.is_set():
+            try:
+                state = self.poll()
+            except Exception as e:
+                logger.error(f"Playback tracker error: {e}")
+                state = self.now_playing()
+            self._wakeup.wait(self._interval(state))
+            self._wakeup.clear()